@@ -14,14 +14,19 @@
 
 from util import manhattanDistance
 from game import Grid
+from game import Actions
 import os
 import random
 
 VISIBILITY_MATRIX_CACHE = {}
+ACTION_TABLE_CACHE = {}
 
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    Layouts are never changed once loaded, so every state and game played
+    on one shares it, copies included.
     """
 
     def __init__(self, layoutText):
@@ -35,6 +40,7 @@ class Layout:
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
+        self.initializeActionTable()
         # self.initializeVisibilityMatrix()
 
     def getNumGhosts(self):
@@ -61,6 +67,13 @@ class Layout:
         else:
             self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
 
+    def initializeActionTable(self):
+        # the legal actions of each position, built once per layout text
+        key = '\n'.join(self.layoutText)
+        if key not in ACTION_TABLE_CACHE:
+            ACTION_TABLE_CACHE[key] = Actions.getActionTable(self.walls)
+        self.actionTable = ACTION_TABLE_CACHE[key]
+
     def isWall(self, pos):
         x, col = pos
         return self.walls[x][col]
@@ -90,7 +103,7 @@ class Layout:
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -50,6 +50,7 @@ from six.moves import range
 
 import pacman_utils.layout as layout
 from pacman_utils.game import Actions
+from pacman_utils.game import Configuration
 from pacman_utils.game import Directions
 from pacman_utils.game import Game
 from pacman_utils.game import GameStateData
@@ -80,16 +81,45 @@ class GameState:
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
+    # static variables keep track of the states generateSuccessor is called on and creates,
+    # once turned on with trackExplored (off by default, as recording a state costs a hash)
     explored = set()
+    exploredMode = None     # None: off, 'count': only count the states, 'states': keep them too
+    exploredLimit = None    # most states kept in explored, None for no limit
+    exploredCount = 0       # states recorded (repeats included) since the last reset
+
+    def trackExplored(mode='states', limit=None):
+        if mode not in [None, 'count', 'states']:
+            raise Exception('Unknown explored state tracking mode: ' + str(mode))
+        GameState.exploredMode = mode
+        GameState.exploredLimit = limit
+        GameState.getAndResetExplored()
+
+    trackExplored = staticmethod(trackExplored)
 
     def getAndResetExplored():
         tmp = GameState.explored.copy()
         GameState.explored = set()
+        GameState.exploredCount = 0
         return tmp
 
     getAndResetExplored = staticmethod(getAndResetExplored)
 
+    def getExploredCount():
+        return GameState.exploredCount
+
+    getExploredCount = staticmethod(getExploredCount)
+
+    def recordExplored(states):
+        GameState.exploredCount += len(states)
+        if GameState.exploredMode == 'states':
+            for state in states:
+                if GameState.exploredLimit != None and len(GameState.explored) >= GameState.exploredLimit:
+                    break
+                GameState.explored.add(state)
+
+    recordExplored = staticmethod(recordExplored)
+
     def getLegalActions(self, agentIndex=0):
         """
         Returns the legal actions for the agent specified.
@@ -112,29 +142,73 @@ class GameState:
 
         # Copy current state
         state = GameState(self)
+        state.resolveMove(agentIndex, action)
+        state.data.updateZobrist(self.data)
+        if GameState.exploredMode != None:
+            GameState.recordExplored([self, state])
+        return state
 
-        # Let agent's logic deal with its action's effects on the board
-        if agentIndex == 0:  # Pacman is moving
-            state.data._eaten = [False for i in range(state.getNumAgents())]
-            PacmanRules.applyAction(state, action)
-        else:  # A ghost is moving
-            GhostRules.applyAction(state, action, agentIndex)
-
-        # Time passes
+    def apply(self, agentIndex, action):
+        """
+        Makes the move generateSuccessor(agentIndex, action) would, but on this
+        state itself rather than on a copy, so search can run without copying
+        states.  undo() takes the move back again.
+        """
+        if self.isWin() or self.isLose():
+            raise Exception('Can\'t apply a move to a terminal state.')
+
+        # A ghost's move can only change that ghost, while Pacman's can scare
+        # or eat any of them.  The rules change the agent states only this
+        # state refers to in place (and copy the others first), so their
+        # configurations and scared timers are kept to put back on undo.  The
+        # rules replace the food grid, capsule list and _eaten rather than
+        # change them, so keeping the old ones is enough to undo those
+        data = self.data
         if agentIndex == 0:
-            state.data.scoreChange += -TIME_PENALTY  # Penalty for waiting around
+            agents = tuple([(agentState.configuration, agentState.scaredTimer) for agentState in data.agentStates])
         else:
-            GhostRules.decrementTimer(state.data.agentStates[agentIndex])
-
-        # Resolve multi-agent effects
-        GhostRules.checkDeath(state, agentIndex)
-
-        # Book keeping
-        state.data._agentMoved = agentIndex
-        state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
-        return state
+            agentState = data.agentStates[agentIndex]
+            agents = ((agentState.configuration, agentState.scaredTimer),)
+        if self.undoStack is None:
+            self.undoStack = []
+        self.undoStack.append((agentIndex, agents, data.food, data.capsules, data._eaten, data.score,
+                               data.scoreChange, data._foodEaten, data._foodAdded, data._capsuleEaten,
+                               data._agentMoved, data._zobrist))
+
+        data.scoreChange = 0
+        data._foodEaten = data._foodAdded = data._capsuleEaten = None
+        self.resolveMove(agentIndex, action)
+
+        for index, (configuration, scaredTimer) in zip(self.getMovedAgents(agentIndex), agents):
+            data.updateAgentZobrist(index, configuration, scaredTimer)
+        data.updateItemZobrist()
+
+    def undo(self):
+        """
+        Takes back the last move made with apply.
+        """
+        (agentIndex, agents, food, capsules, eaten, score, scoreChange, foodEaten, foodAdded,
+         capsuleEaten, agentMoved, zobrist) = self.undoStack.pop()
+
+        data = self.data
+        for index, (configuration, scaredTimer) in zip(self.getMovedAgents(agentIndex), agents):
+            agentState = data.agentStates[index]
+            if agentState.configuration is not configuration or agentState.scaredTimer != scaredTimer:
+                agentState = data.getAgentStateForWrite(index)
+                agentState.configuration = configuration
+                agentState.scaredTimer = scaredTimer
+        data.food, data.capsules, data._eaten = food, capsules, eaten
+        data.score, data.scoreChange = score, scoreChange
+        data._foodEaten, data._foodAdded, data._capsuleEaten = foodEaten, foodAdded, capsuleEaten
+        data._agentMoved = agentMoved
+        data._zobrist = zobrist
+        data._win = data._lose = False  # moves can only be applied to states that weren't over
+
+    def getMovedAgents(self, agentIndex):
+        # the indices of the agents a move of agentIndex can change
+        if agentIndex == 0:
+            return range(self.getNumAgents())
+        return (agentIndex,)
 
     def getLegalPacmanActions(self):
         return self.getLegalActions(0)
@@ -243,6 +317,35 @@ class GameState:
         state.data = self.data.deepCopy()
         return state
 
+    # moves made by apply that can still be undone, created by the first one
+    undoStack = None
+
+    def resolveMove(self, agentIndex, action):
+        """
+        Applies the rules of an agent's move to this state, for
+        generateSuccessor and apply.
+        """
+        # Let agent's logic deal with its action's effects on the board
+        if agentIndex == 0:  # Pacman is moving
+            if True in self.data._eaten:
+                self.data._eaten = [False for i in range(self.getNumAgents())]
+            PacmanRules.applyAction(self, action)
+        else:  # A ghost is moving
+            GhostRules.applyAction(self, action, agentIndex)
+
+        # Time passes
+        if agentIndex == 0:
+            self.data.scoreChange += -TIME_PENALTY  # Penalty for waiting around
+        else:
+            GhostRules.decrementTimer(self.data.getAgentStateForWrite(agentIndex))
+
+        # Resolve multi-agent effects
+        GhostRules.checkDeath(self, agentIndex)
+
+        # Book keeping
+        self.data._agentMoved = agentIndex
+        self.data.score += self.data.scoreChange
+
     def __eq__(self, other):
         """
         Allows two states to be compared.
@@ -286,11 +389,11 @@ class ClassicGameRules:
     def __init__(self, timeout=30):
         self.timeout = timeout
 
-    def newGame(self, layout, pacmanAgent, ghostAgents, display, quiet=False, catchExceptions=False):
+    def newGame(self, layout, pacmanAgent, ghostAgents, display, quiet=False, catchExceptions=False, fast=False):
         agents = [pacmanAgent] + ghostAgents[:layout.getNumGhosts()]
         initState = GameState()
         initState.initialize(layout, len(ghostAgents))
-        game = Game(agents, display, self, catchExceptions=catchExceptions)
+        game = Game(agents, display, self, catchExceptions=catchExceptions, fast=fast)
         game.state = initState
         self.initialState = initState.deepCopy()
         self.quiet = quiet
@@ -347,7 +450,8 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions(state.getPacmanState().configuration, state.data.layout.walls)
+        layout = state.data.layout
+        return Actions.getPossibleActions(state.getPacmanState().configuration, layout.walls, layout.actionTable)
 
     getLegalActions = staticmethod(getLegalActions)
 
@@ -359,7 +463,7 @@ class PacmanRules:
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.getAgentStateForWrite(0)
 
         # Update Configuration
         vector = Actions.directionToVector(action, PacmanRules.PACMAN_SPEED)
@@ -389,11 +493,12 @@ class PacmanRules:
                 state.data._win = True
         # Eat capsule
         if (position in state.getCapsules()):
+            state.data.capsules = state.data.capsules[:]
             state.data.capsules.remove(position)
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range(1, len(state.data.agentStates)):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.getAgentStateForWrite(index).scaredTimer = SCARED_TIME
 
     consume = staticmethod(consume)
 
@@ -410,7 +515,8 @@ class GhostRules:
         reach a dead end, but can turn 90 degrees at intersections.
         """
         conf = state.getGhostState(ghostIndex).configuration
-        possibleActions = Actions.getPossibleActions(conf, state.data.layout.walls)
+        layout = state.data.layout
+        possibleActions = Actions.getPossibleActions(conf, layout.walls, layout.actionTable)
         reverse = Actions.reverseDirection(conf.direction)
         if Directions.STOP in possibleActions:
             possibleActions.remove(Directions.STOP)
@@ -426,7 +532,7 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.getAgentStateForWrite(ghostIndex)
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
         vector = Actions.directionToVector(action, speed)
@@ -437,7 +543,9 @@ class GhostRules:
     def decrementTimer(ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint(ghostState.configuration.pos)
+            # a new configuration, as the current one is shared with the previous state
+            ghostState.configuration = Configuration(nearestPoint(ghostState.configuration.pos),
+                                                     ghostState.configuration.direction)
         ghostState.scaredTimer = max(0, timer - 1)
 
     decrementTimer = staticmethod(decrementTimer)
@@ -461,9 +569,11 @@ class GhostRules:
     def collide(state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            ghostState = state.data.getAgentStateForWrite(agentIndex)
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
             # Added for first-person
+            state.data._eaten = state.data._eaten[:]
             state.data._eaten[agentIndex] = True
         else:
             if not state.data._win:
@@ -554,15 +664,26 @@ def readCommand(argv):
                       help='Turns on exception handling and timeouts during games', default=False)
     parser.add_option('--timeout', dest='timeout', type='int',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--trackExplored', dest='trackExplored', type='choice', choices=['count', 'states'],
+                      help='Records the states successors are generated from and to: count them, or keep them', default=None)
+    parser.add_option('--exploredLimit', dest='exploredLimit', type='int',
+                      help='Most explored states to keep with --trackExplored states (default no limit)', default=None)
+    parser.add_option('--fast', action='store_true', dest='fast',
+                      help='Plays quiet (-q) games in a faster loop that gives agents the game\'s own states, which they must not change, instead of copies', default=False)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
         raise Exception('Command line input not understood: ' + str(otherjunk))
+    if options.fast and (not options.quietGraphics or options.catchExceptions):
+        raise Exception('Only quiet games without exception handling (-q without -c) can be played fast')
     args = dict()
 
     # Fix the random seed
     if options.fixRandomSeed: random.seed('cs188')
 
+    # Explored state instrumentation
+    if options.trackExplored: GameState.trackExplored(options.trackExplored, options.exploredLimit)
+
     # Choose a layout
     args['layout'] = layout.getLayout(options.layout)
     if args['layout'] == None: raise Exception("The layout " + options.layout + " cannot be found")
@@ -601,6 +722,7 @@ def readCommand(argv):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['fast'] = options.fast
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
@@ -674,7 +796,7 @@ def replayGame(layout, actions, display):
     display.finish()
 
 
-def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, catchExceptions=False, timeout=30):
+def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, catchExceptions=False, timeout=30, fast=False):
     # noinspection PyUnresolvedReferences
     import __main__
     __main__.__dict__['_display'] = display
@@ -692,7 +814,7 @@ def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, c
         else:
             gameDisplay = display
             rules.quiet = False
-        game = rules.newGame(layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
+        game = rules.newGame(layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions, fast)
         game.run()
         if not beQuiet: games.append(game)
 
@@ -712,6 +834,8 @@ def runGames(layout, pacman, ghosts, display, numGames, record, numTraining=0, c
         print('Scores:       ', ', '.join([str(score) for score in scores]))
         print('Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate))
         print('Record:       ', ', '.join([['Loss', 'Win'][int(w)] for w in wins]))
+    if GameState.exploredMode != None:
+        print('Explored states:', GameState.getExploredCount())
 
     return games
 
@@ -23,6 +23,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import random
 import traceback
 
 from .util import *
@@ -80,8 +81,13 @@ class Configuration:
 
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
+
+    Configurations are shared between states, so they are never changed once
+    made; moves make new ones instead.
     """
 
+    __slots__ = ('pos', 'direction')
+
     def __init__(self, pos, direction):
         self.pos = pos
         self.direction = direction
@@ -130,6 +136,8 @@ class AgentState:
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
 
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
+
     def __init__(self, startConfiguration, isPacman):
         self.start = startConfiguration
         self.configuration = startConfiguration
@@ -171,9 +179,14 @@ class AgentState:
 
 class Grid:
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
-    via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
-    y vertical and the origin (0,0) in the bottom left corner.
+    A 2-dimensional array of booleans backed by a single int bitboard, where
+    (x,y) is bit x * height + y.  Data is accessed via grid[x][y] where (x,y)
+    are positions on a Pacman map with x horizontal, y vertical and the origin
+    (0,0) in the bottom left corner.
+
+    The bitboard is an immutable int, so copies share it until one of them is
+    written to, and the number of True cells and the hash are kept cached.
+    Copying, counting and hashing are all O(1).
 
     The __str__ method constructs an output that is oriented like a pacman board.
     """
@@ -184,59 +197,76 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self.bits = (1 << (width * height)) - 1 if initialValue else 0
+        self._count = width * height if initialValue else 0
+        self._hash = None
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        if 0 <= i < self.width:
+            return GridColumn(self, i)
+        if -self.width <= i < 0:
+            return GridColumn(self, i + self.width)
+        raise IndexError('Grid column index out of range')
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        column = self[key]
+        for y, value in enumerate(item):
+            column[y] = value
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield GridColumn(self, x)
+
+    def __len__(self):
+        return self.width
 
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
 
     def __eq__(self, other):
         if other is None:
             return False
-        return self.data == other.data
+        return self.bits == other.bits and self.width == other.width and self.height == other.height
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        if self._hash is None:
+            self._hash = hash(self.bits)
+        return self._hash
 
     def copy(self):
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g.bits = self.bits
+        g._count = self._count
+        g._hash = self._hash
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
-        return g
+        return self.copy()
 
     def count(self, item=True):
-        return sum([x.count(item) for x in self.data])
+        if item:
+            return self._count
+        return self.width * self.height - self._count
 
     def asList(self, key=True):
         grid_list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key:
-                    grid_list.append((x, y))
+        if key:
+            bits = self.bits
+            while bits:
+                lowest = bits & -bits
+                grid_list.append(self._cellIndexToPosition(lowest.bit_length() - 1))
+                bits ^= lowest
+        else:
+            for i in range(self.width * self.height):
+                if not (self.bits >> i) & 1:
+                    grid_list.append(self._cellIndexToPosition(i))
         return grid_list
 
     def packBits(self):
@@ -249,8 +279,7 @@ class Grid:
         currentInt = 0
         for i in range(self.height * self.width):
             bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-            x, y = self._cellIndexToPosition(i)
-            if self[x][y]:
+            if (self.bits >> i) & 1:
                 currentInt += 2 ** bit
             if (i + 1) % self.CELLS_PER_INT == 0:
                 bits.append(currentInt)
@@ -259,7 +288,7 @@ class Grid:
         return tuple(bits)
 
     def _cellIndexToPosition(self, index):
-        x = index / self.height
+        x = index // self.height
         y = index % self.height
         return x, y
 
@@ -271,9 +300,11 @@ class Grid:
         for packed in bits:
             for bit in self._unpackInt(packed, self.CELLS_PER_INT):
                 if cell == self.width * self.height: break
-                x, y = self._cellIndexToPosition(cell)
-                self[x][y] = bit
+                if bit:
+                    self.bits |= 1 << cell
                 cell += 1
+        self._count = bin(self.bits).count('1')
+        self._hash = None
 
     def _unpackInt(self, packed, size):
         bools_list = []
@@ -289,6 +320,51 @@ class Grid:
         return bools_list
 
 
+class GridColumn:
+    """
+    A view of column x of a Grid, so that grid[x][y] reads and writes the
+    grid's bitboard.
+    """
+
+    __slots__ = ('grid', 'offset')
+
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.offset = x * grid.height
+
+    def _bit(self, y):
+        if y < 0:
+            y += self.grid.height
+        if not 0 <= y < self.grid.height:
+            raise IndexError('Grid row index out of range')
+        return 1 << (self.offset + y)
+
+    def __getitem__(self, y):
+        if 0 <= y < self.grid.height:
+            return (self.grid.bits >> (self.offset + y)) & 1 == 1
+        return self.grid.bits & self._bit(y) != 0
+
+    def __setitem__(self, y, value):
+        grid = self.grid
+        bit = self._bit(y)
+        if value and not grid.bits & bit:
+            grid.bits |= bit
+            grid._count += 1
+        elif not value and grid.bits & bit:
+            grid.bits &= ~bit
+            grid._count -= 1
+        else:
+            return
+        grid._hash = None
+
+    def __iter__(self):
+        for y in range(self.grid.height):
+            yield self[y]
+
+    def __len__(self):
+        return self.grid.height
+
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1, 2)):
         return bitRep
@@ -348,7 +424,13 @@ class Actions:
 
     directionToVector = staticmethod(directionToVector)
 
-    def getPossibleActions(config, walls):
+    def getPossibleActions(config, walls, actionTable=None):
+        # positions in the layout's actionTable (see getActionTable) are just looked up
+        if actionTable is not None:
+            possible = actionTable.get(config.pos)
+            if possible is not None:
+                return list(possible)
+
         possible = []
         x, y = config.pos
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -382,6 +464,26 @@ class Actions:
 
     getLegalNeighbors = staticmethod(getLegalNeighbors)
 
+    def getActionTable(walls):
+        """
+        Returns the possible actions of every position that isn't a wall, as
+        a dictionary from the position to a tuple, so getPossibleActions can
+        look them up rather than check the walls around it.
+
+        Positions on the edge of the grid are left out, and so are positions
+        between grid points (such as those of scared ghosts), which
+        getPossibleActions still works out from the walls.
+        """
+        actionTable = {}
+        for x in range(1, walls.width - 1):
+            for y in range(1, walls.height - 1):
+                if not walls[x][y]:
+                    config = Configuration((x, y), Directions.STOP)
+                    actionTable[(x, y)] = tuple(Actions.getPossibleActions(config, walls))
+        return actionTable
+
+    getActionTable = staticmethod(getActionTable)
+
     def getSuccessor(position, action):
         dx, dy = Actions.directionToVector(action)
         x, y = position
@@ -390,9 +492,37 @@ class Actions:
     getSuccessor = staticmethod(getSuccessor)
 
 
-class GameStateData:
+# Random keys of the features of game states, see zobristKey.  They come
+# from their own generator so hashing never disturbs the game's random
+# numbers.
+ZOBRIST_KEYS = {}
+ZOBRIST_RANDOM = random.Random(0)
+
+
+def zobristKey(feature):
     """
+    Returns the random 64 bit key of a hashable feature of a game state
+    (such as an agent's position, or food on a cell), making one the first
+    time the feature is seen.
+    """
+    key = ZOBRIST_KEYS.get(feature)
+    if key is None:
+        key = ZOBRIST_KEYS[feature] = ZOBRIST_RANDOM.getrandbits(64)
+    return key
+
 
+class GameStateData:
+    """
+    The data of a game state.  Its hash is the Zobrist hash of the agent
+    states, food and capsules (the XOR of their zobristKeys) combined with the
+    score, and GameState.generateSuccessor keeps it up to date by XORing in
+    and out just what a move changes, so hashing a state is O(1).
+
+    Successors share the agent states, capsule list and food grid of the data
+    they are generated from, so only what a move changes gets copied: agent
+    states must be changed through getAgentStateForWrite, which copies those
+    shared with other data, and the capsule list and food grid replaced by
+    copies before changing them.
     """
 
     def __init__(self, prevState=None):
@@ -401,11 +531,18 @@ class GameStateData:
         """
         if prevState is not None:
             self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates(prevState.agentStates)
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self._zobrist = prevState._zobrist
+            # prevState's agent states are shared with this data now, so it
+            # has to copy them before changing them too
+            prevState._ownedAgents.clear()
+        else:
+            self._zobrist = 0
+        self._ownedAgents = set()  # indices of the agent states not shared with other data
 
         self._foodEaten = None
         self._foodAdded = None
@@ -416,15 +553,31 @@ class GameStateData:
         self.scoreChange = 0
 
     def deepCopy(self):
+        owned = set(self._ownedAgents)  # a deep copy shares no agent states
         state = GameStateData(self)
+        self._ownedAgents = owned
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates(self.agentStates)
+        state._ownedAgents = set(range(len(state.agentStates)))
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.layout = self.layout
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
         return state
 
+    def getAgentStateForWrite(self, index):
+        """
+        Returns the state of an agent, copying it first if it is shared with
+        other data (the data this was generated from, or data generated from
+        this).
+        """
+        if index not in self._ownedAgents:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgents.add(index)
+        return self.agentStates[index]
+
     def copyAgentStates(self, agentStates):
         copiedStates = []
         for agentState in agentStates:
@@ -452,25 +605,67 @@ class GameStateData:
         """
         Allows states to be keys of dictionaries.
         """
-        for i, state in enumerate(self.agentStates):
-            try:
-                int(hash(state))
-            except TypeError as e:
-                print(e)
-                # hash(state)
-        return int((hash(tuple(self.agentStates)) +
-                    13 * hash(self.food) + 113 * hash(tuple(self.capsules)) +
-                    7 * hash(self.score)) % 1048575)
+        return hash((self._zobrist, self.score))
+
+    @staticmethod
+    def agentKey(index, configuration, scaredTimer):
+        """
+        Returns the Zobrist key of an agent's configuration and scared timer.
+        """
+        key = zobristKey(('scared', index, scaredTimer))
+        if configuration is not None:
+            key ^= zobristKey(('agent', index, configuration.pos, configuration.direction))
+        return key
+
+    def computeZobrist(self):
+        """
+        Returns the Zobrist hash of the agents, food and capsules from scratch.
+        """
+        zobrist = 0
+        for index, agentState in enumerate(self.agentStates):
+            zobrist ^= self.agentKey(index, agentState.configuration, agentState.scaredTimer)
+        for x, y in self.food.asList():
+            zobrist ^= zobristKey(('food', x, y))
+        for capsule in self.capsules:
+            zobrist ^= zobristKey(('capsule', capsule))
+        return zobrist
+
+    def updateZobrist(self, prevState):
+        """
+        Updates the Zobrist hash copied from prevState (the data this was
+        generated from) with the changes made by one move.
+        """
+        for index in self._ownedAgents:
+            previous = prevState.agentStates[index]
+            self.updateAgentZobrist(index, previous.configuration, previous.scaredTimer)
+        self.updateItemZobrist()
+
+    def updateAgentZobrist(self, index, configuration, scaredTimer):
+        """
+        Updates the Zobrist hash for a move that may have changed an agent,
+        given its configuration and scared timer before the move.
+        """
+        agentState = self.agentStates[index]
+        if agentState.configuration != configuration or agentState.scaredTimer != scaredTimer:
+            self._zobrist ^= (self.agentKey(index, configuration, scaredTimer) ^
+                              self.agentKey(index, agentState.configuration, agentState.scaredTimer))
+
+    def updateItemZobrist(self):
+        """
+        Updates the Zobrist hash for the food and capsule eaten by a move.
+        """
+        for position in [self._foodEaten, self._foodAdded]:
+            if position is not None:
+                self._zobrist ^= zobristKey(('food',) + tuple(position))
+        if self._capsuleEaten is not None:
+            self._zobrist ^= zobristKey(('capsule', self._capsuleEaten))
 
     def __str__(self):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
         if type(self.food) == type((1, 2)):
             self.food = reconstituteGrid(self.food)
-        for x in range(width):
-            for y in range(height):
-                food, walls = self.food, self.layout.walls
-                map[x][y] = self._foodWallStr(food[x][y], walls[x][y])
+        food, walls = self.food, self.layout.walls
+        map = [[self._foodWallStr(food[x][y], walls[x][y]) for y in range(height)] for x in range(width)]
 
         for agentState in self.agentStates:
             if agentState is None:
@@ -487,7 +682,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        out = [''.join([map[x][y] for x in range(width)]) for y in range(height)]
+        out.reverse()
+        return '\n'.join(out) + ("\nScore: %d\n" % self.score)
 
     @staticmethod
     def _foodWallStr(hasFood, hasWall):
@@ -540,6 +737,8 @@ class GameStateData:
                     numGhosts += 1
             self.agentStates.append(AgentState(Configuration(pos, Directions.STOP), isPacman))
         self._eaten = [False for a in self.agentStates]
+        self._ownedAgents = set(range(len(self.agentStates)))
+        self._zobrist = self.computeZobrist()
 
 
 try:
@@ -555,7 +754,7 @@ class Game:
     The Game manages the control flow, soliciting actions from agents.
     """
 
-    def __init__(self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False):
+    def __init__(self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False, fast=False):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -564,6 +763,7 @@ class Game:
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
+        self.fast = fast
         self.moveHistory = []
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
@@ -602,10 +802,57 @@ class Game:
         sys.stdout = OLD_STDOUT
         sys.stderr = OLD_STDERR
 
+    def runFast(self):
+        """
+        Control loop for trusted, headless game play, used instead of run
+        when the game is made with fast set.
+
+        Agents are given the game's own states instead of deep copies, so
+        they must not change them, and they are neither timed nor muted.
+        Their methods are looked up once, at the start of the game.
+        """
+        self.display.initialize(self.state.data)
+        self.numMoves = 0
+
+        for i in range(len(self.agents)):
+            agent = self.agents[i]
+            if not agent:
+                # this is a null agent, meaning it failed to load
+                print("Agent %d failed to load" % i, file=sys.stderr)
+                self._agentCrash(i, quiet=True)
+                return
+            if "registerInitialState" in dir(agent):
+                agent.registerInitialState(self.state)
+
+        observationFunctions = [getattr(agent, 'observationFunction', None) for agent in self.agents]
+        getActions = [agent.getAction for agent in self.agents]
+        agentIndex = self.startingIndex
+        numAgents = len(self.agents)
+
+        while not self.gameOver:
+            observation = self.state
+            if observationFunctions[agentIndex] != None:
+                observation = observationFunctions[agentIndex](observation)
+            action = getActions[agentIndex](observation)
+
+            self.moveHistory.append((agentIndex, action))
+            self.state = self.state.generateSuccessor(agentIndex, action)
+            self.display.update(self.state.data)
+            self.rules.process(self.state, self)
+            agentIndex = (agentIndex + 1) % numAgents
+
+        for agent in self.agents:
+            if "final" in dir(agent):
+                agent.final(self.state)
+        self.display.finish()
+
     def run(self):
         """
         Main control loop for game play.
         """
+        if self.fast:
+            return self.runFast()
+
         self.display.initialize(self.state.data)
         self.numMoves = 0
 
@@ -15,6 +15,7 @@
 from __future__ import absolute_import
 from .util import manhattanDistance
 from .game import Grid
+from .game import Actions
 import os
 import random
 from six.moves import range
@@ -22,11 +23,15 @@ from six.moves import zip
 from functools import reduce
 
 VISIBILITY_MATRIX_CACHE = {}
+ACTION_TABLE_CACHE = {}
 
 
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    Layouts are never changed once loaded, so every state and game played
+    on one shares it, copies included.
     """
 
     def __init__(self, layoutText):
@@ -40,6 +45,7 @@ class Layout:
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
+        self.initializeActionTable()
         # self.initializeVisibilityMatrix()
 
     def getNumGhosts(self):
@@ -51,9 +57,10 @@ class Layout:
             from .game import Directions
             vecs = [(-0.5, 0), (0.5, 0), (0, -0.5), (0, 0.5)]
             dirs = [Directions.NORTH, Directions.SOUTH, Directions.WEST, Directions.EAST]
-            vis = Grid(self.width, self.height,
-                       {Directions.NORTH: set(), Directions.SOUTH: set(), Directions.EAST: set(),
-                        Directions.WEST: set(), Directions.STOP: set()})
+            # a nested list rather than a Grid, as Grids only hold booleans
+            vis = [[{Directions.NORTH: set(), Directions.SOUTH: set(), Directions.EAST: set(),
+                     Directions.WEST: set(), Directions.STOP: set()}
+                    for y in range(self.height)] for x in range(self.width)]
             for x in range(self.width):
                 for y in range(self.height):
                     if not self.walls[x][y]:
@@ -62,12 +69,19 @@ class Layout:
                             nextx, nexty = x + dx, y + dy
                             while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)]:
                                 vis[x][y][direction].add((nextx, nexty))
-                                nextx, nexty = x + dx, y + dy
+                                nextx, nexty = nextx + dx, nexty + dy
             self.visibility = vis
             VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
         else:
             self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
 
+    def initializeActionTable(self):
+        # the legal actions of each position, built once per layout text
+        key = '\n'.join(self.layoutText)
+        if key not in ACTION_TABLE_CACHE:
+            ACTION_TABLE_CACHE[key] = Actions.getActionTable(self.walls)
+        self.actionTable = ACTION_TABLE_CACHE[key]
+
     def isWall(self, pos):
         x, col = pos
         return self.walls[x][col]
@@ -97,7 +111,7 @@ class Layout:
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        return self
 
     def processLayoutText(self, layoutText):
         """
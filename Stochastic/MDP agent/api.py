@@ -32,6 +32,8 @@
 
 from random import random
 from pacman import Directions
+import hashlib
+import mazeDistances
 import util
 
 #
@@ -180,6 +182,31 @@ def walls(state):
                 wallList.append((i, j))            
     return wallList
 
+def distance(state, pos1, pos2):
+    # Returns the number of moves it takes to get from pos1 to pos2
+    # through the maze, rather than the Manhattan distance.
+    #
+    # The distances between all pairs of positions are worked out the
+    # first time they are asked for on a layout (see mazeDistances.py),
+    # so after that this is just a lookup. Agents that only need the
+    # distances near Pacman are better off with a short search.
+
+    return distanceTable(state).getDistance(pos1, pos2)
+
+def distanceTable(state):
+    # Returns the table of maze distances used by distance(), for
+    # agents that look up many distances and want to keep it around.
+    #
+    # Its getDistance(pos1, pos2) method works like distance() above.
+
+    return mazeDistances.getMazeDistances(state.data.layout)
+
+def layoutKey(state):
+    # Returns a string identifying the layout being played, the same
+    # for every game on it, for agents that cache things per layout.
+
+    return hashlib.sha1('\n'.join(state.data.layout.layoutText)).hexdigest()
+
 def corners(state):
     # Returns the coordinates of the four corners of the state space.
     #
@@ -67,15 +67,20 @@ class Directions:
                WEST: EAST,
                STOP: STOP}
 
-class Configuration:
+class Configuration(object):
     """
     A Configuration holds the (x,y) coordinate of a character, along with its
     traveling direction.
 
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
+
+    Configurations are shared between states, so they are never changed once
+    made; moves make new ones instead.
     """
 
+    __slots__ = ('pos', 'direction')
+
     def __init__(self, pos, direction):
         self.pos = pos
         self.direction = direction
@@ -117,11 +122,13 @@ class Configuration:
             direction = self.direction # There is no stop direction
         return Configuration((x + dx, y+dy), direction)
 
-class AgentState:
+class AgentState(object):
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
 
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
+
     def __init__( self, startConfiguration, isPacman ):
         self.start = startConfiguration
         self.configuration = startConfiguration
@@ -173,7 +180,7 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self.data = [[initialValue] * height for x in range(width)]
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
@@ -204,7 +211,7 @@ class Grid:
         return hash(h)
 
     def copy(self):
-        g = Grid(self.width, self.height)
+        g = self._blankCopy()
         g.data = [x[:] for x in self.data]
         return g
 
@@ -212,10 +219,24 @@ class Grid:
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
+        g = self._blankCopy()
         g.data = self.data
         return g
 
+    def columnCopy(self, x):
+        # a copy that shares every column but x with this grid, for changing just column x
+        g = self._blankCopy()
+        g.data = self.data[:]
+        g.data[x] = self.data[x][:]
+        return g
+
+    def _blankCopy(self):
+        # a grid of the same size whose data is left for the caller to set
+        g = Grid(0, 0)
+        g.width = self.width
+        g.height = self.height
+        return g
+
     def count(self, item =True ):
         return sum([x.count(item) for x in self.data])
 
@@ -329,7 +350,13 @@ class Actions:
         return (dx * speed, dy * speed)
     directionToVector = staticmethod(directionToVector)
 
-    def getPossibleActions(config, walls):
+    def getPossibleActions(config, walls, actionTable=None):
+        # positions in the layout's actionTable (see getActionTable) are just looked up
+        if actionTable is not None:
+            possible = actionTable.get(config.pos)
+            if possible is not None:
+                return list(possible)
+
         possible = []
         x, y = config.pos
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -362,6 +389,26 @@ class Actions:
         return neighbors
     getLegalNeighbors = staticmethod(getLegalNeighbors)
 
+    def getActionTable(walls):
+        """
+        Returns the possible actions of every position that isn't a wall, as
+        a dictionary from the position to a tuple, so getPossibleActions can
+        look them up rather than check the walls around it.
+
+        Positions on the edge of the grid are left out, and so are positions
+        between grid points (such as those of scared ghosts), which
+        getPossibleActions still works out from the walls.
+        """
+        actionTable = {}
+        for x in range(1, walls.width - 1):
+            for y in range(1, walls.height - 1):
+                if not walls[x][y]:
+                    config = Configuration((x, y), Directions.STOP)
+                    actionTable[(x, y)] = tuple(Actions.getPossibleActions(config, walls))
+        return actionTable
+
+    getActionTable = staticmethod(getActionTable)
+
     def getSuccessor(position, action):
         dx, dy = Actions.directionToVector(action)
         x, y = position
@@ -370,7 +417,10 @@ class Actions:
 
 class GameStateData:
     """
-
+    Successors share the agent states and capsule list of the data they are
+    generated from, so only what a move changes gets copied: agent states
+    must be changed through getAgentStateForWrite, and the capsule list
+    replaced by a copy before changing it.
     """
     def __init__( self, prevState = None ):
         """
@@ -378,11 +428,12 @@ class GameStateData:
         """
         if prevState != None:
             self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+        self._ownedAgents = set() # indices of the agent states not shared with prevState
 
         self._foodEaten = None
         self._foodAdded = None
@@ -394,14 +445,27 @@ class GameStateData:
 
     def deepCopy( self ):
         state = GameStateData( self )
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        state._ownedAgents = set( range( len( state.agentStates ) ) )
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.layout = self.layout
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
         return state
 
+    def getAgentStateForWrite( self, index ):
+        """
+        Returns the state of an agent, copying it first if it is still shared
+        with the data this was generated from.
+        """
+        if index not in self._ownedAgents:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgents.add( index )
+        return self.agentStates[index]
+
     def copyAgentStates( self, agentStates ):
         copiedStates = []
         for agentState in agentStates:
@@ -503,6 +567,7 @@ class GameStateData:
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
         self._eaten = [False for a in self.agentStates]
+        self._ownedAgents = set( range( len( self.agentStates ) ) )
 
 try:
     import boinc
@@ -515,7 +580,7 @@ class Game:
     The Game manages the control flow, soliciting actions from agents.
     """
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False, fast=False ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -524,6 +589,7 @@ class Game:
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
+        self.fast = fast
         self.moveHistory = []
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
@@ -564,10 +630,57 @@ class Game:
         sys.stderr = OLD_STDERR
 
 
+    def runFast(self):
+        """
+        Control loop for trusted, headless game play, used instead of run
+        when the game is made with fast set.
+
+        Agents are given the game's own states instead of deep copies, so
+        they must not change them, and they are neither timed nor muted.
+        Their methods are looked up once, at the start of the game.
+        """
+        self.display.initialize(self.state.data)
+        self.numMoves = 0
+
+        for i in range(len(self.agents)):
+            agent = self.agents[i]
+            if not agent:
+                # this is a null agent, meaning it failed to load
+                print >>sys.stderr, "Agent %d failed to load" % i
+                self._agentCrash(i, quiet=True)
+                return
+            if "registerInitialState" in dir(agent):
+                agent.registerInitialState(self.state)
+
+        observationFunctions = [getattr(agent, 'observationFunction', None) for agent in self.agents]
+        getActions = [agent.getAction for agent in self.agents]
+        agentIndex = self.startingIndex
+        numAgents = len(self.agents)
+
+        while not self.gameOver:
+            observation = self.state
+            if observationFunctions[agentIndex] != None:
+                observation = observationFunctions[agentIndex](observation)
+            action = getActions[agentIndex](observation)
+
+            self.moveHistory.append((agentIndex, action))
+            self.state = self.state.generateSuccessor(agentIndex, action)
+            self.display.update(self.state.data)
+            self.rules.process(self.state, self)
+            agentIndex = (agentIndex + 1) % numAgents
+
+        for agent in self.agents:
+            if "final" in dir(agent):
+                agent.final(self.state)
+        self.display.finish()
+
     def run( self ):
         """
         Main control loop for game play.
         """
+        if self.fast:
+            return self.runFast()
+
         self.display.initialize(self.state.data)
         self.numMoves = 0
 
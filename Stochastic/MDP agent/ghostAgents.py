@@ -17,6 +17,7 @@ from game import Actions
 from game import Directions
 import random
 from util import manhattanDistance
+import mazeDistances
 import util
 
 class GhostAgent( Agent ):
@@ -64,7 +65,7 @@ class DirectionalGhost( GhostAgent ):
         pacmanPosition = state.getPacmanPosition()
 
         # Select best actions given the state
-        distancesToPacman = [manhattanDistance( pos, pacmanPosition ) for pos in newPositions]
+        distancesToPacman = [self.getDistance( state, pos, pacmanPosition ) for pos in newPositions]
         if isScared:
             bestScore = max( distancesToPacman )
             bestProb = self.prob_scaredFlee
@@ -79,3 +80,11 @@ class DirectionalGhost( GhostAgent ):
         for a in legalActions: dist[a] += ( 1-bestProb ) / len(legalActions)
         dist.normalize()
         return dist
+
+    def getDistance( self, state, pos1, pos2 ):
+        return manhattanDistance( pos1, pos2 )
+
+class MazeDirectionalGhost( DirectionalGhost ):
+    "A directional ghost that measures its distance to Pacman through the maze."
+    def getDistance( self, state, pos1, pos2 ):
+        return mazeDistances.getMazeDistances( state.data.layout ).getDistance( pos1, pos2 )
@@ -0,0 +1,97 @@
+# layoutBenchmark.py
+#
+# Times the state handling Game.run does every turn - a deep copy of
+# the state for the agent to observe, then the successor of its move -
+# on generated open mazes of growing size, e.g.
+#
+#   python layoutBenchmark.py -s 10,20,40,80,160 -t 2000
+#
+# Only ghosts move, so no food is eaten. The layout is shared between
+# copies, but the deep copy still copies the food grid, so the time per
+# turn grows slowly with the maze (about 4 times from 10x10 to 160x160).
+# The script fails if the time per turn on the largest maze is more than
+# --max-growth times that on the smallest, which catches copies that
+# rebuild the layout (about 250 times over the same sizes).
+
+from optparse import OptionParser
+import random
+import sys
+import time
+
+import layout
+import pacman
+
+def readCommand(argv):
+    parser = OptionParser("python layoutBenchmark.py <options>")
+    parser.add_option('-s', '--sizes', dest='sizes', default='10,20,40,80,160',
+                      help='comma separated widths (and heights) of the mazes to time')
+    parser.add_option('-t', '--turns', dest='turns', type='int', default=2000,
+                      help='the number of turns to time per maze')
+    parser.add_option('--seed', dest='seed', type='int', default=43,
+                      help='random seed used at the start of each maze')
+    parser.add_option('--max-growth', dest='maxGrowth', type='float', default=10,
+                      help='fail if the time per turn on the largest maze is more than this many times that on the smallest')
+
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+
+    return options
+
+# an open maze of pillars and food, with Pacman in one corner and two ghosts in the other
+def makeLayout(size):
+    rows = []
+    for y in range(size):
+        row = ''
+        for x in range(size):
+            if x in (0, size - 1) or y in (0, size - 1) or (x % 2 == 0 and y % 2 == 0):
+                row += '%'
+            else:
+                row += '.'
+        rows.append(row)
+
+    rows[1] = rows[1][:1] + 'GG' + rows[1][3:]
+    rows[-2] = rows[-2][:-2] + 'P' + rows[-2][-1:]
+    return layout.Layout(rows)
+
+# returns the seconds per deep copy and per turn on one maze
+def benchmark(gameLayout, turns, seed):
+    random.seed(seed)
+    initial = pacman.GameState()
+    initial.initialize(gameLayout, gameLayout.getNumGhosts())
+    numAgents = initial.getNumAgents()
+
+    start = time.time()
+    for i in range(turns):
+        initial.deepCopy()
+    copyTime = (time.time() - start) / turns
+
+    state = initial
+    start = time.time()
+    for i in range(turns):
+        if state.isWin() or state.isLose():
+            state = initial
+        agentIndex = 1 + i % (numAgents - 1)
+        observation = state.deepCopy()
+        action = random.choice(observation.getLegalActions(agentIndex))
+        state = state.generateSuccessor(agentIndex, action)
+    turnTime = (time.time() - start) / turns
+
+    return copyTime, turnTime
+
+# returns whether the time per turn stayed within the growth bound
+def runBenchmark(options):
+    print '%-10s %8s %12s %12s' % ('maze', 'cells', 'us/copy', 'us/turn')
+    turnTimes = {}
+    for size in [int(size) for size in options.sizes.split(',')]:
+        copyTime, turnTime = benchmark(makeLayout(size), options.turns, options.seed)
+        turnTimes[size] = turnTime
+        print '%-10s %8d %12.1f %12.1f' % ('%dx%d' % (size, size), size * size, 1e6 * copyTime, 1e6 * turnTime)
+
+    growth = turnTimes[max(turnTimes)] / turnTimes[min(turnTimes)]
+    print 'time per turn grew %.1f times from the smallest maze to the largest (at most %.1f)' % (growth, options.maxGrowth)
+    return growth <= options.maxGrowth
+
+if __name__ == '__main__':
+    if not runBenchmark(readCommand(sys.argv[1:])):
+        sys.exit(1)
@@ -0,0 +1,169 @@
+# mazeDistances.py
+#
+# All-pairs maze distances for a layout.
+#
+# The distances are found with a breadth first search from every
+# traversable coordinate, and stored in a single array indexed by
+# (source index * number of coordinates + target index). They are built
+# the first time they are asked for on a layout, kept in memory for as
+# long as the program runs, and saved to CACHE_DIRECTORY so later runs on
+# the same layout just load them. A table takes time and memory in the
+# square of the size of the maze, so it is only worth it for agents that
+# look up distances between far apart positions.
+#
+# Use getMazeDistances(layout) to get the distances of a layout, or the
+# distance() function in api.py from an agent.
+
+import array
+import hashlib
+import math
+import os
+import tempfile
+
+# where distance tables are saved between runs, None to only keep them in memory
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.mazedistances')
+
+# distance stored for pairs with no path between them
+UNREACHABLE = 65535
+
+DISTANCE_CACHE = {}
+
+def getMazeDistances(layout):
+    """
+    Returns the MazeDistances of a layout, building them if they aren't
+    cached in memory or on disk yet.
+    """
+    key = '\n'.join(layout.layoutText)
+    if key not in DISTANCE_CACHE:
+        DISTANCE_CACHE[key] = MazeDistances(layout.walls, hashlib.sha1(key).hexdigest())
+    return DISTANCE_CACHE[key]
+
+class MazeDistances:
+    """
+    Shortest path distances between every pair of traversable coordinates
+    of a wall grid.
+    """
+
+    def __init__(self, walls, name=None):
+        self.walls = walls
+
+        # index -> coordinate, and coordinate -> index
+        self.cells = [(x, y) for x in range(walls.width) for y in range(walls.height) if not walls[x][y]]
+        self.cellIndex = dict((cell, index) for (index, cell) in enumerate(self.cells))
+
+        self.distances = None
+        if name != None and CACHE_DIRECTORY != None:
+            self.distances = self.load(os.path.join(CACHE_DIRECTORY, name))
+        if self.distances == None:
+            self.distances = self.build()
+            if name != None and CACHE_DIRECTORY != None:
+                self.save(os.path.join(CACHE_DIRECTORY, name))
+
+    def build(self):
+        size = len(self.cells)
+        neighbours = []
+        for (x, y) in self.cells:
+            adjacent = [(x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y)]
+            neighbours.append([self.cellIndex[cell] for cell in adjacent if cell in self.cellIndex])
+
+        distances = array.array('H', [UNREACHABLE]) * (size * size)
+        for source in range(size):
+            offset = source * size
+            distances[offset + source] = 0
+            frontier = [source]
+            depth = 0
+
+            while frontier:
+                depth += 1
+                nextFrontier = []
+                for cell in frontier:
+                    for neighbour in neighbours[cell]:
+                        if distances[offset + neighbour] == UNREACHABLE:
+                            distances[offset + neighbour] = depth
+                            nextFrontier.append(neighbour)
+                frontier = nextFrontier
+
+        return distances
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return None
+
+        distances = array.array('H')
+        f = open(path, 'rb')
+        try:
+            distances.fromstring(f.read())
+        finally:
+            f.close()
+
+        # stale or damaged cache files are rebuilt
+        if len(distances) != len(self.cells) ** 2:
+            return None
+        return distances
+
+    def save(self, path):
+        if not os.path.isdir(CACHE_DIRECTORY):
+            try:
+                os.makedirs(CACHE_DIRECTORY)
+            except OSError:
+                # made by another game running at the same time
+                if not os.path.isdir(CACHE_DIRECTORY):
+                    raise
+
+        # written to a temporary file and renamed, so a game running at the
+        # same time never loads a half written table
+        (handle, temporaryPath) = tempfile.mkstemp(dir=CACHE_DIRECTORY)
+        f = os.fdopen(handle, 'wb')
+        try:
+            f.write(self.distances.tostring())
+        finally:
+            f.close()
+
+        try:
+            os.rename(temporaryPath, path)
+        except OSError:
+            # renaming over an existing file fails on Windows, in which
+            # case another game has already saved the same table
+            os.remove(temporaryPath)
+
+    def isTraversable(self, pos):
+        return pos in self.cellIndex
+
+    def getDistance(self, pos1, pos2):
+        """
+        Returns the number of moves between two positions, or UNREACHABLE.
+
+        Positions between two coordinates (such as those of scared ghosts)
+        are measured through the nearest traversable coordinates, plus the
+        distance to them.
+        """
+        if pos1 in self.cellIndex and pos2 in self.cellIndex:
+            return self.distances[self.cellIndex[pos1] * len(self.cells) + self.cellIndex[pos2]]
+
+        best = UNREACHABLE
+        for (cell1, offset1) in self.getNearestCells(pos1):
+            for (cell2, offset2) in self.getNearestCells(pos2):
+                distance = self.distances[self.cellIndex[cell1] * len(self.cells) + self.cellIndex[cell2]]
+                if distance != UNREACHABLE:
+                    best = min(best, distance + offset1 + offset2)
+        return best
+
+    def getDistancesFrom(self, pos):
+        """
+        Returns a dictionary of the distance from pos to every coordinate
+        it can reach.
+        """
+        size = len(self.cells)
+        offset = self.cellIndex[pos] * size
+        row = self.distances[offset:offset + size]
+        return dict((self.cells[i], row[i]) for i in range(size) if row[i] != UNREACHABLE)
+
+    def getNearestCells(self, pos):
+        # traversable coordinates around a (possibly fractional) position, with the distance to each
+        x, y = pos
+        cells = []
+        for cellX in set([int(math.floor(x)), int(math.ceil(x))]):
+            for cellY in set([int(math.floor(y)), int(math.ceil(y))]):
+                if (cellX, cellY) in self.cellIndex:
+                    cells.append(((cellX, cellY), abs(x - cellX) + abs(y - cellY)))
+        return cells
@@ -31,14 +31,119 @@
 from pacman import Directions
 from game import Agent
 import api
+import cPickle
+import collections
 import random
 import game
 import util
+import heapq
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+
+# numpy is only needed by the array based solvers (-a solver=numpy or solver=policy)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# scipy is only needed by the sparse policy iteration solver (-a solver=policy)
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    scipy = None
+
+# analysis of every layout played so far, layout key -> attributes (see layoutAttributes),
+# shared by all the games and agents on the same layout
+LAYOUT_ANALYSES = {}
+
+# where layoutCache=1 saves layout analyses between runs
+LAYOUT_CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.mdplayouts')
+
+# state of a worker process of the parallel solver: a copy of the agent, views of the two
+# shared value arrays (the current sweep's, and the next one's) and of the shared policy array
+WORKER = {}
+
+def startWorker(agent, valueBuffers, policyBuffer):
+    WORKER["agent"] = agent
+    WORKER["values"] = [numpy.frombuffer(buffer, dtype=float) for buffer in valueBuffers]
+    WORKER["policy"] = numpy.frombuffer(policyBuffer, dtype=numpy.intc)
+
+# runs the parallel solver's work for one band of rows: finds the policy of the values in
+# values[parity] (and whether it changed), then sweeps them into values[1 - parity]
+def sweepBand(task):
+    (band, parity) = task
+    agent = WORKER["agent"]
+    cells = agent.bands[band]
+    successors = agent.successors[cells]
+    values = WORKER["values"][parity]
+
+    policy = agent.getArrayUtilities(values, successors).argmax(axis=-1)
+    changed = not numpy.array_equal(WORKER["policy"][cells], policy)
+    WORKER["policy"][cells] = policy
+
+    change = agent.discount * agent.getArrayExpectedUtility(values, successors)
+    WORKER["values"][1 - parity][cells] = values[cells] + change
+
+    return (changed, float(abs(change).max()))
 
 class MDPAgent(Agent):
 
+    # numeric value of each direction, used to combine directions in translateDirection
+    dirValue = {
+        Directions.NORTH : 0,
+        Directions.EAST : 1,
+        Directions.SOUTH : 2,
+        Directions.WEST : 3,
+        Directions.STOP : 0
+    }
+
+    # attributes worked out by registerDimensions and registerPaths that only depend on the layout
+    layoutAttributes = ["width", "height", "transitions", "cellBits", "bitCells", "deadendMask", "cells", "cellIndex", "successors", "corridors"]
+
     # Constructor: this gets run when we first invoke pacman.py
-    def __init__(self):
+    #
+    # solver selects the value iteration backend, passed with -a solver=...
+    #   value: iterates over the dictionary based value map (default)
+    #   numpy: runs the same sweeps as whole-array numpy operations
+    #   gaussSeidel: updates the value map in place, so later coordinates see this sweep's updates.
+    #                like the policy solver, the utilities are the standard discounted sum of rewards
+    #   prioritized: like gaussSeidel, but always updates the coordinate whose utility would change
+    #                the most next, until no change would be larger than threshold (or tolerance)
+    #   policy: modified policy iteration with sparse matrices, evaluating each policy with
+    #           evaluationSteps matrix-vector products, or an exact sparse solve when 0
+    #   parallel: the numpy solver's sweeps split into bands of rows, one per worker process
+    #             (workers, all cores by default), sharing the value arrays between them
+    #   corridor: solves the junction graph of the maze, with corridors contracted into edges,
+    #             then expands the values back along the corridors and refines them with
+    #             fineSweeps sweeps over every coordinate. like the policy solver, the utilities
+    #             are the standard discounted sum of rewards
+    #
+    # value iteration stops after the first of these is met:
+    #   stableSweeps: the policy has not changed for this many consecutive sweeps
+    #   tolerance: no utility changed by more than this in the last sweep (off by default)
+    #   maxSweeps: this many sweeps have been run (unbounded by default)
+    #   deadline: this many seconds have passed since the move started (unbounded by default),
+    #             checked between sweeps so the policy of the last full sweep is used
+    #
+    # telemetry is the path of a CSV file that per-move solver statistics get appended to
+    #
+    # warmStart (policy solver only) starts each move from the utilities the previous move
+    # converged to, and the policy that is best for them, rather than from the rewards. the
+    # utilities of consecutive moves are close, so fewer iterations are needed
+    #
+    # horizon (value solver only) solves just the coordinates near pacman, out to the number
+    # of moves after which the discounted largest reward falls below this tolerance
+    #
+    # cacheSize is how many converged policies to remember within a game, so that a situation
+    # seen before (same pacman, ghost, food and capsule positions) is not solved again
+    #
+    # layoutCache is a directory to save the analysis of each layout in, so later runs skip it
+    # (1 for LAYOUT_CACHE_DIRECTORY). within a run layouts are only ever analysed once
+    def __init__(self, solver="value", stableSweeps=3, tolerance=None, maxSweeps=None, telemetry=None, warmStart=False, horizon=None, cacheSize=0, deadline=None, evaluationSteps=0, layoutCache=None, workers=None, fineSweeps=2, threshold=0.001):
         print "Starting up MDPAgent!"
         name = "Pacman"
         self.currentTrack = None    # for debugging purposes
@@ -46,13 +151,22 @@ class MDPAgent(Agent):
         self.width = None
         self.height = None
 
-        # trackers (to save computational power)
-        self.foundFoods = []
-        self.capsules = []
+        # trackers (to save computational power), food, capsules and deadends are bitsets
+        # of the coordinates they are on, see cellBits
+        self.foodMask = 0
+        self.foodCount = 0
+        self.capsuleMask = 0
         self.ghostSpawn = []
-        self.deadends = []
+        self.deadendMask = 0
         self.baseValueMap = {}
 
+        # coordinate -> [(direction, ((coordinate, probability), ...)), ...], built once per layout
+        self.transitions = {}
+
+        # coordinate -> bit, and bit index -> coordinate
+        self.cellBits = {}
+        self.bitCells = []
+
         # the rewards depending on whats on a certain coordinate
         self.discount = 0.6 # how relevant future steps are
         self.foodReward = 1
@@ -62,9 +176,82 @@ class MDPAgent(Agent):
         self.deadEndRewardReduction = -self.foodReward
         self.ghostRespawnReward = -self.foodReward * 2    # dangerous when ghosts may respawn
         self.capsuleReward = -self.foodReward  # want to save these for when they're needed
+        self.ghostRadius = 10   # ghosts further than this many moves away are not a threat
         
         self.allDirections = [Directions.NORTH, Directions.EAST, Directions.SOUTH, Directions.WEST]  # excluding STOP
 
+        # value iteration backend
+        if solver not in ["value", "numpy", "gaussSeidel", "prioritized", "policy", "parallel", "corridor"]:
+            raise Exception("Unknown MDPAgent solver: " + str(solver))
+        if solver in ["numpy", "policy", "parallel", "corridor"] and numpy == None:
+            raise Exception("The " + solver + " solver requires numpy to be installed")
+        if solver == "policy" and scipy == None:
+            raise Exception("The policy solver requires scipy to be installed")
+        self.solver = solver
+        self.evaluationSteps = int(evaluationSteps)
+        self.threshold = float(threshold)
+
+        # worker processes of the parallel solver, started for each game
+        self.workers = multiprocessing.cpu_count() if workers == None else int(workers)
+        self.pool = None
+        self.bands = []     # coordinate indices of each band of rows
+        self.valueBuffers = []
+        self.policyBuffer = None
+
+        # warm start, utilities of every compiled coordinate the last move converged to
+        self.warmStart = str(warmStart).lower() in ["1", "true"]
+        if self.warmStart and solver != "policy":
+            raise Exception("warmStart is only supported by the policy solver")
+        self.warmValues = None
+
+        # bounded horizon, radius of the last solved region
+        self.horizon = None if horizon == None else float(horizon)
+        if self.horizon != None and solver != "value":
+            raise Exception("horizon is only supported by the value solver")
+        self.radius = None
+
+        # least recently used cache of policies, situation -> policy
+        self.cacheSize = int(cacheSize)
+        self.policyCache = collections.OrderedDict()
+        self.cacheHits = 0
+        self.cacheMisses = 0
+
+        # the move being decided, set by getRewards for chooseAction
+        self.legal = []
+        self.pacman = None
+        self.situation = None
+        self.cachedPolicy = None
+
+        # convergence criteria
+        self.stableSweeps = int(stableSweeps)
+        self.tolerance = None if tolerance == None else float(tolerance)
+        self.maxSweeps = None if maxSweeps == None else int(maxSweeps)
+        self.deadline = None if deadline == None else float(deadline)
+        self.deadlineTime = None    # time the current move has to be decided by
+
+        # statistics of the last value iteration run
+        self.sweeps = 0
+        self.residual = 0
+        self.solveTime = 0
+        self.timedOut = False   # whether the deadline stopped the last run
+        self.telemetry = [] # (sweeps, seconds, residual, timedOut) of every move in the current game
+        self.telemetryFile = telemetry
+        self.gameCount = 0
+
+        # compiled layout for the numpy solver
+        self.cells = []     # index -> coordinate
+        self.cellIndex = {} # coordinate -> index
+        self.successors = None  # (cells x directions x outcomes) successor indices
+
+        # junction graph of the corridor solver, see compileCorridors
+        self.corridors = None
+        self.fineSweeps = int(fineSweeps)
+
+        # directory layout analyses are saved in, None to only keep them in memory
+        if str(layoutCache).lower() in ["1", "true"]:
+            layoutCache = LAYOUT_CACHE_DIRECTORY
+        self.layoutCache = layoutCache
+
 
     # Gets run after an MDPAgent object is created and once there is
     # game state to access.
@@ -75,18 +262,23 @@ class MDPAgent(Agent):
         self.currentTrack = api.whereAmI(state) # for debugging purposes
 
         # retrieve the necessary state information
-        self.foundFoods = api.food(state)
-        self.capsules = api.capsules(state)
         self.ghostSpawn = api.ghosts(state)
+
+        self.telemetry = []
+        self.gameCount += 1
+        self.policyCache.clear()
+        self.warmValues = None
         
-        self.registerDimensions(state)
-        self.registerPaths(state)
-        self.registerValues()
+        self.registerLayout(state)
+        self.registerValues(state)
+
+        if self.solver == "parallel":
+            self.startWorkers()
         
     # This is what gets run in between multiple games
     def final(self, state):
         #print "Looks like the game just ended!"
-        #print "Food left: ", len(self.foundFoods)
+        #print "Food left: ", self.foodCount
 
         # reset values
         self.currentTrack = api.whereAmI(state) # for debugging purposes
@@ -94,13 +286,105 @@ class MDPAgent(Agent):
         self.width = None
         self.height = None
 
-        self.foundFoods = []
-        self.capsules = []
+        self.foodMask = 0
+        self.foodCount = 0
+        self.capsuleMask = 0
         self.ghostSpawn = []
-        self.deadends = []
+        self.deadendMask = 0
         self.baseValueMap = {}
+        self.transitions = {}
+        self.cellBits = {}
+        self.bitCells = []
+        self.policyCache.clear()
+        self.warmValues = None
+
+        self.cells = []
+        self.cellIndex = {}
+        self.successors = None
+        self.corridors = None
+        self.stopWorkers()
         
 
+    # registers the dimensions and paths of the current game, the layout is only analysed
+    # the first time it is played, later games on it reuse the same attributes
+    def registerLayout(self, state):
+        key = api.layoutKey(state)
+        analysis = LAYOUT_ANALYSES.get(key)
+        path = None
+
+        if self.layoutCache != None:
+            path = os.path.join(self.layoutCache, key)
+            if analysis == None:
+                analysis = self.loadAnalysis(path)
+
+        if analysis == None:
+            self.registerDimensions(state)
+            self.registerPaths(state)
+        else:
+            for name in self.layoutAttributes:
+                setattr(self, name, analysis[name])
+            self.baseValueMap = dict.fromkeys(self.bitCells, self.pathReward)
+            LAYOUT_ANALYSES[key] = analysis
+
+            # unless it was analysed by an agent whose solver needed less of the layout compiled
+            compile = self.solver in ["numpy", "policy", "parallel", "corridor"] and self.successors is None
+            contract = self.solver == "corridor" and self.corridors is None
+            if not compile and not contract:
+                return
+
+            if compile:
+                self.compileLayout()
+            if contract:
+                self.compileCorridors()
+
+        analysis = dict((name, getattr(self, name)) for name in self.layoutAttributes)
+        LAYOUT_ANALYSES[key] = analysis
+        if path != None:
+            self.saveAnalysis(path, analysis)
+
+    # loads a saved layout analysis, or returns None if there is none (or it cant be read)
+    def loadAnalysis(self, path):
+        if not os.path.exists(path):
+            return None
+
+        f = open(path, 'rb')
+        try:
+            analysis = cPickle.load(f)
+        except (EOFError, cPickle.UnpicklingError):
+            return None
+        finally:
+            f.close()
+
+        # saved by an older version of the agent
+        if sorted(analysis.keys()) != sorted(self.layoutAttributes):
+            return None
+        return analysis
+
+    def saveAnalysis(self, path, analysis):
+        if not os.path.isdir(self.layoutCache):
+            try:
+                os.makedirs(self.layoutCache)
+            except OSError:
+                # made by another game running at the same time
+                if not os.path.isdir(self.layoutCache):
+                    raise
+
+        # written to a temporary file and renamed, so a game running at the
+        # same time never loads a half written analysis
+        (handle, temporaryPath) = tempfile.mkstemp(dir=self.layoutCache)
+        f = os.fdopen(handle, 'wb')
+        try:
+            cPickle.dump(analysis, f, 2)
+        finally:
+            f.close()
+
+        try:
+            os.rename(temporaryPath, path)
+        except OSError:
+            # renaming over an existing file fails on Windows, in which
+            # case another game has already saved the same analysis
+            os.remove(temporaryPath)
+
     # registers the width-height of the current game
     def registerDimensions(self, state):
         corners = api.corners(state)
@@ -126,69 +410,706 @@ class MDPAgent(Agent):
                 if (i, j) not in walls:
                     self.baseValueMap[(i, j)] = self.pathReward
 
+        # register the outcomes of moving in each direction, the intended one with
+        # probability 0.8, and either side of it with probability 0.1
+        for coordinate in self.baseValueMap:
+            self.transitions[coordinate] = []
+
+            for direct in self.allDirections:
+                outcomes = (
+                    (self.getTransitionVector(coordinate, direct), 0.8),
+                    (self.getTransitionVector(coordinate, self.translateDirection(direct, Directions.WEST)), 0.1),
+                    (self.getTransitionVector(coordinate, self.translateDirection(direct, Directions.EAST)), 0.1))
+                self.transitions[coordinate].append((direct, outcomes))
+
+        # give every coordinate its own bit, for compact sets of coordinates
+        self.bitCells = sorted(self.baseValueMap)
+        for (index, coordinate) in enumerate(self.bitCells):
+            self.cellBits[coordinate] = 1 << index
+
         # register deadends (only 1 legal move)
-        for coordinate in self.baseValueMap.keys():
+        for (coordinate, moves) in self.transitions.iteritems():
             count = 0
-            for direction in self.allDirections:
-                if self.getTransitionVector(coordinate, direction) != coordinate:
+            for (direct, outcomes) in moves:
+                if outcomes[0][0] != coordinate:
                     count += 1
 
             if count == 1:
-                self.deadends.append(coordinate)
+                self.deadendMask |= self.cellBits[coordinate]
+
+        if self.solver in ["numpy", "policy", "parallel", "corridor"]:
+            self.compileLayout()
+        if self.solver == "corridor":
+            self.compileCorridors()
+
+    # compiles the traversable coordinates into index arrays for the numpy solver
+    def compileLayout(self):
+        self.cells = sorted(self.baseValueMap.keys())
+        self.cellIndex = dict((cell, index) for (index, cell) in enumerate(self.cells))
+
+        # successors[cell, direction] holds the intended, left (west-rotated) and
+        # right (east-rotated) outcomes, in the same order as getExpectedUtility
+        self.successors = numpy.zeros((len(self.cells), len(self.allDirections), 3), dtype=numpy.intp)
+
+        for (index, cell) in enumerate(self.cells):
+            for (d, (direct, outcomes)) in enumerate(self.transitions[cell]):
+                for (o, (successor, probability)) in enumerate(outcomes):
+                    self.successors[index, d, o] = self.cellIndex[successor]
+
+    # contracts the corridors of the compiled layout into the edges of a junction graph
+    #
+    # the nodes are the coordinates that don't have exactly two neighbours (junctions and deadends,
+    # plus one coordinate of any loop without them). each edge runs from a node in one direction,
+    # through the corridor coordinates (entries) to the next node, and each corridor has an edge
+    # in both directions
+    def compileCorridors(self):
+        neighbours = []
+        for index in range(len(self.cells)):
+            neighbours.append(sorted(set(self.successors[index, :, 0].tolist()) - set([index])))
+
+        isNode = [len(cellNeighbours) != 2 for cellNeighbours in neighbours]
+        covered = list(isNode)
+        edges = []  # (start node cell, end node cell, corridor cells)
+
+        nodes = [index for index in range(len(self.cells)) if isNode[index]]
+        pending = list(nodes)
+        while True:
+            for start in pending:
+                for neighbour in neighbours[start]:
+                    (previous, current, path) = (start, neighbour, [])
+                    while not isNode[current]:
+                        covered[current] = True
+                        path.append(current)
+                        (previous, current) = (current, [cell for cell in neighbours[current] if cell != previous][0])
+                    edges.append((start, current, path))
+
+            # loops without any node get one
+            loops = [index for index in range(len(self.cells)) if not covered[index]]
+            if not loops:
+                break
+            isNode[loops[0]] = True
+            covered[loops[0]] = True
+            nodes.append(loops[0])
+            pending = [loops[0]]
+
+        nodeIndex = dict((cell, index) for (index, cell) in enumerate(nodes))
+
+        # entries, in decreasing position along their edges (the order they are expanded in)
+        entries = [(position, e, cell) for (e, (start, end, path)) in enumerate(edges) for (position, cell) in enumerate(path)]
+        entries.sort(key=lambda entry: -entry[0])
+        entryIndex = dict(((e, position), i) for (i, (position, e, cell)) in enumerate(entries))
+
+        self.corridors = {
+            "nodes": numpy.array(nodes, dtype=numpy.intp),
+            "edgeStart": numpy.array([nodeIndex[start] for (start, end, path) in edges], dtype=numpy.intp),
+            "edgeEnd": numpy.array([nodeIndex[end] for (start, end, path) in edges], dtype=numpy.intp),
+            "edgeLength": numpy.array([len(path) for (start, end, path) in edges]),
+            "edgeFirst": numpy.array([entryIndex.get((e, 0), -1) for e in range(len(edges))], dtype=numpy.intp),
+            "entryEdge": numpy.array([e for (position, e, cell) in entries], dtype=numpy.intp),
+            "entryCell": numpy.array([cell for (position, e, cell) in entries], dtype=numpy.intp),
+            "entryNext": numpy.array([entryIndex.get((e, position + 1), -1) for (position, e, cell) in entries], dtype=numpy.intp),
+            "positions": [numpy.array([i for (i, entry) in enumerate(entries) if entry[0] == position], dtype=numpy.intp)
+                          for position in sorted(set(entry[0] for entry in entries), reverse=True)]
+        }
 
     # registers the values of states (food, capsules, deadends)
-    def registerValues(self):
-        for food in self.foundFoods:
+    def registerValues(self, state):
+        foods = api.food(state)
+        self.foodMask = self.getMask(foods)
+        self.foodCount = len(foods)
+        self.capsuleMask = self.getMask(api.capsules(state))
+
+        for food in self.getCells(self.foodMask):
             self.baseValueMap[food] = self.foodReward
         
-        for capsule in self.capsules:
+        for capsule in self.getCells(self.capsuleMask):
             self.baseValueMap[capsule] = self.capsuleReward
 
-        for deadend in self.deadends:
+        for deadend in self.getCells(self.deadendMask):
             self.baseValueMap[deadend] += self.deadEndRewardReduction
 
+    # returns the bitset of a list of coordinates
+    def getMask(self, coordinates):
+        mask = 0
+        for coordinate in coordinates:
+            mask |= self.cellBits[coordinate]
+
+        return mask
+
+    # returns the coordinates of a bitset, lowest bit first
+    def getCells(self, mask):
+        cells = []
+        while mask:
+            bit = mask & -mask
+            cells.append(self.bitCells[bit.bit_length() - 1])
+            mask ^= bit
+
+        return cells
+
+
+    # get the final converged policy, pacman's position is only needed by the horizon mode
+    def getPolicy(self, valueMap, pacman=None):
+        start = time.time()
+        self.timedOut = False
+
+        if self.solver == "numpy":
+            result = self.getArrayPolicy(valueMap)
+        elif self.solver == "parallel":
+            result = self.getParallelPolicy(valueMap)
+        elif self.solver == "corridor":
+            result = self.getCorridorPolicy(valueMap)
+        elif self.solver == "policy":
+            result = self.getSparsePolicy(valueMap)
+        elif self.solver == "prioritized":
+            result = self.convergePrioritizedPolicy(valueMap)
+        elif self.horizon != None:
+            result = self.getLocalPolicy(valueMap, pacman)
+        else:
+            policy = dict()
+
+            # create initial policy
+            for coordinate in valueMap.keys():
+                policy[coordinate] = self.getMaxExpectedUtility(valueMap, coordinate)[0]
+
+            if self.solver == "gaussSeidel":
+                result = self.convergeGaussSeidelPolicy(valueMap, policy)
+            else:
+                result = self.convergePolicy(valueMap, policy)
+
+        self.solveTime = time.time() - start
+        self.recordTelemetry()
+
+        return result
+
+    # iterate computation of values until the stopping criteria are met
+    #
+    # only the given coordinates are updated (all of them by default), any other
+    # coordinate in the value map keeps its utility
+    def convergePolicy(self, valueMap, policy, coordinates=None):
+        partial = coordinates != None
+        if not partial:
+            coordinates = valueMap.keys()
+
+        self.sweeps = 0
+        stable = 0
+
+        while True:
+            tempMap = dict(valueMap) if partial else dict()
+            tempPolicy = dict()
+            self.residual = 0
+
+            # update utility rewards
+            for coordinate in coordinates:
+                change = self.discount * self.getExpectedUtility(valueMap, coordinate)
+                tempMap[coordinate] = valueMap[coordinate] + change
+                self.residual = max(self.residual, abs(change))
+
+            # update policy
+            for coordinate in coordinates:
+                tempPolicy[coordinate] = self.getMaxExpectedUtility(tempMap, coordinate)[0]
+
+            self.sweeps += 1
+            if policy == tempPolicy:
+                stable += 1
+            else:
+                stable = 0
+
+            valueMap = tempMap
+            policy = tempPolicy
+
+            if self.isConverged(stable):
+                return (valueMap, policy)
+
+    # bounded horizon version of getPolicy
+    #
+    # a reward d moves away is discounted by discount^d, so past the radius where even the
+    # largest reward falls below the horizon tolerance the rest of the maze is left out. the
+    # coordinates on the edge of the region keep their reward as a fixed utility
+    def getLocalPolicy(self, valueMap, pacman):
+        largest = max(abs(value) for value in valueMap.itervalues())
+        self.radius = 1
+        if largest > self.horizon:
+            self.radius = max(1, int(math.ceil(math.log(self.horizon / largest) / math.log(self.discount))))
+
+        distances = self.getDistancesInRadius(pacman, self.radius)
+        interior = [coordinate for coordinate in distances if distances[coordinate] < self.radius]
+        localMap = dict((coordinate, valueMap[coordinate]) for coordinate in distances)
 
-    # get the final converged policy
-    def getPolicy(self, valueMap):
         policy = dict()
 
         # create initial policy
-        for coordinate in valueMap.keys():
+        for coordinate in interior:
+            policy[coordinate] = self.getMaxExpectedUtility(localMap, coordinate)[0]
+
+        return self.convergePolicy(localMap, policy, interior)
+
+    # in place (Gauss-Seidel) value iteration, each update sees the utilities already updated
+    # earlier in the same sweep
+    #
+    # updating the value map in place only settles when the update is a contraction, so unlike
+    # convergePolicy this solves for the standard discounted sum of rewards, as the policy solver
+    # does: the utility of a coordinate is its reward plus the discounted best expected utility
+    def convergeGaussSeidelPolicy(self, valueMap, policy):
+        rewards = valueMap
+        valueMap = dict(valueMap)
+        self.sweeps = 0
+        stable = 0
+
+        while True:
+            self.residual = 0
+
+            for coordinate in valueMap:
+                change = self.getBellmanError(rewards, valueMap, coordinate)
+                valueMap[coordinate] += change
+                self.residual = max(self.residual, abs(change))
+
+            (policy, stable) = self.updatePolicy(valueMap, policy, stable)
+
+            if self.isConverged(stable):
+                return (valueMap, policy)
+
+    # prioritized sweeping version of convergeGaussSeidelPolicy
+    #
+    # the Bellman error of every coordinate (how far its next update would move it) is kept on a
+    # heap, and the coordinate with the largest error is always updated next. an update only
+    # changes the errors of the coordinate and its neighbours, so just those are recomputed and
+    # pushed back. errors no larger than the threshold (tolerance when given) are never pushed,
+    # so it stops once every error is below it, or at maxSweeps or the deadline, where a sweep
+    # is counted for every update of as many coordinates as there are in the map
+    def convergePrioritizedPolicy(self, valueMap):
+        rewards = valueMap
+        valueMap = dict(valueMap)
+        threshold = self.threshold if self.tolerance == None else self.tolerance
+        size = len(valueMap)
+        self.sweeps = 0
+
+        errors = dict()
+        for coordinate in valueMap:
+            errors[coordinate] = self.getBellmanError(rewards, valueMap, coordinate)
+
+        heap = [(-abs(error), coordinate) for (coordinate, error) in errors.iteritems() if abs(error) > threshold]
+        heapq.heapify(heap)
+        updates = 0
+
+        while heap:
+            (priority, coordinate) = heapq.heappop(heap)
+
+            # skip entries superseded by a newer error
+            if -priority != abs(errors[coordinate]):
+                continue
+
+            valueMap[coordinate] += errors[coordinate]
+
+            for neighbour in self.getNeighbourhood([coordinate]):
+                errors[neighbour] = self.getBellmanError(rewards, valueMap, neighbour)
+                if abs(errors[neighbour]) > threshold:
+                    heapq.heappush(heap, (-abs(errors[neighbour]), neighbour))
+
+            updates += 1
+            if updates % size == 0:
+                self.sweeps += 1
+                if self.isConverged(0):
+                    break
+
+        if updates % size:
+            self.sweeps += 1
+        self.residual = max(abs(error) for error in errors.itervalues())
+
+        policy = dict()
+        for coordinate in valueMap:
             policy[coordinate] = self.getMaxExpectedUtility(valueMap, coordinate)[0]
 
-        return self.convergePolicy(valueMap, False, policy, 0)
+        return (valueMap, policy)
 
-    # iterate computation of values until convergence is maintained for 3 consecutive recursions
-    def convergePolicy(self, valueMap, converged, policy, count):
-        if converged == True:
-            count += 1
-            if count == 3:
-                return (valueMap, policy)
+    # how far the discounted update of a coordinate would change its utility
+    def getBellmanError(self, rewards, valueMap, coordinate):
+        utility = rewards[coordinate] + self.discount * self.getMaxExpectedUtility(valueMap, coordinate)[1]
+        return utility - valueMap[coordinate]
+
+    # recomputes the policy after an in place sweep, returning it with the updated count of
+    # consecutive sweeps it has stayed the same
+    def updatePolicy(self, valueMap, policy, stable):
+        tempPolicy = dict()
+
+        for coordinate in valueMap:
+            tempPolicy[coordinate] = self.getMaxExpectedUtility(valueMap, coordinate)[0]
+
+        self.sweeps += 1
+        if policy == tempPolicy:
+            stable += 1
         else:
-            count = 0
+            stable = 0
+
+        return (tempPolicy, stable)
+
+    # returns the given coordinates along with every coordinate that can transition into them
+    def getNeighbourhood(self, coordinates):
+        neighbourhood = set(coordinates)
+
+        for coordinate in coordinates:
+            for (direct, outcomes) in self.transitions[coordinate]:
+                neighbourhood.add(outcomes[0][0])
+
+        return neighbourhood
 
-        tempMap = dict(valueMap)
-        tempPolicy = dict(policy)
+    # checks the stopping criteria after a sweep, given how many consecutive sweeps left the policy unchanged
+    def isConverged(self, stable):
+        if stable >= self.stableSweeps:
+            return True
+        if self.tolerance != None and self.residual <= self.tolerance:
+            return True
+        if self.maxSweeps != None and self.sweeps >= self.maxSweeps:
+            return True
 
-        # update utility rewards
-        for coordinate in valueMap.keys():
-            tempMap[coordinate] += (self.discount * self.getExpectedUtility(valueMap, coordinate))
+        self.timedOut = self.deadlineTime != None and time.time() >= self.deadlineTime
+        return self.timedOut
 
-        # update policy
-        for coordinate in policy.keys():
-            tempPolicy[coordinate] = self.getMaxExpectedUtility(tempMap, coordinate)[0]
+    # stores the statistics of the last value iteration run, and appends them to the telemetry file
+    def recordTelemetry(self):
+        self.telemetry.append((self.sweeps, self.solveTime, self.residual, self.timedOut))
 
-        return self.convergePolicy(tempMap, (policy == tempPolicy), tempPolicy, count)
+        if self.telemetryFile == None:
+            return
+
+        header = not os.path.exists(self.telemetryFile)
+        output = open(self.telemetryFile, "a")
+        if header:
+            output.write("game,move,solver,sweeps,seconds,residual,timedOut\n")
+        output.write("%d,%d,%s,%d,%f,%g,%d\n" % (self.gameCount, len(self.telemetry), self.solver, self.sweeps, self.solveTime, self.residual, self.timedOut))
+        output.close()
+
+    # numpy version of getPolicy, runs each sweep over all coordinates at once
+    def getArrayPolicy(self, valueMap):
+        values = numpy.array([valueMap[cell] for cell in self.cells], dtype=float)
+        policy = self.getArrayUtilities(values).argmax(axis=-1)
+        self.sweeps = 0
+        stable = 0
+
+        # same stopping rules as convergePolicy
+        while True:
+            change = self.discount * self.getArrayExpectedUtility(values)
+            values = values + change
+            tempPolicy = self.getArrayUtilities(values).argmax(axis=-1)
+
+            self.sweeps += 1
+            self.residual = float(abs(change).max())
+            if numpy.array_equal(policy, tempPolicy):
+                stable += 1
+            else:
+                stable = 0
+
+            policy = tempPolicy
+
+            if self.isConverged(stable):
+                break
+
+        # translate back to the coordinate based maps used by getAction
+        valueMap = dict(zip(self.cells, values.tolist()))
+        policy = dict((cell, self.allDirections[d]) for (cell, d) in zip(self.cells, policy.tolist()))
+
+        return (valueMap, policy)
+
+    # parallel version of getArrayPolicy, the worker processes each run the sweeps of their own
+    # band of rows, reading the whole of the previous sweep's shared values
+    #
+    # each round of work finds the policy of one sweep and runs the next sweep, so the values and
+    # policies of every sweep are identical to the numpy solver's
+    def getParallelPolicy(self, valueMap):
+        values = [numpy.frombuffer(buffer, dtype=float) for buffer in self.valueBuffers]
+        values[0][:] = [valueMap[cell] for cell in self.cells]
+        parity = 0
+
+        # initial policy, and the first sweep
+        results = self.pool.map(sweepBand, [(band, parity) for band in range(len(self.bands))])
+        residual = max(result[1] for result in results)
+        self.sweeps = 0
+        stable = 0
+
+        # same stopping rules as convergePolicy
+        while True:
+            parity = 1 - parity
+            results = self.pool.map(sweepBand, [(band, parity) for band in range(len(self.bands))])
+
+            self.sweeps += 1
+            self.residual = residual
+            if any(result[0] for result in results):
+                stable = 0
+            else:
+                stable += 1
+
+            residual = max(result[1] for result in results)
+
+            if self.isConverged(stable):
+                break
+
+        # translate back to the coordinate based maps used by getAction
+        policy = numpy.frombuffer(self.policyBuffer, dtype=numpy.intc)
+        valueMap = dict(zip(self.cells, values[parity].tolist()))
+        policy = dict((cell, self.allDirections[d]) for (cell, d) in zip(self.cells, policy.tolist()))
+
+        return (valueMap, policy)
+
+    # coarse to fine version of getSparsePolicy, solving the junction graph (see compileCorridors)
+    # rather than every coordinate
+    #
+    # the utility of a node is its reward plus that of the best edge out of it, the discounted
+    # rewards along the corridor and the discounted utility of the node at its end. slipping
+    # sideways is ignored on this coarse level, which only provides the starting utilities for
+    # fineSweeps full sweeps of the standard update over every coordinate
+    def getCorridorPolicy(self, valueMap):
+        corridors = self.corridors
+        rewards = numpy.array([valueMap[cell] for cell in self.cells], dtype=float)
+        nodeRewards = rewards[corridors["nodes"]]
+        edgeStart = corridors["edgeStart"]
+        edgeEnd = corridors["edgeEnd"]
+
+        # discounted rewards along each corridor, worked back from its end
+        corridorValues = self.getCorridorValues(rewards, numpy.zeros(len(edgeEnd)))
+        first = corridors["edgeFirst"]
+        hasCorridor = first >= 0
+        edgeRewards = numpy.zeros(len(first))
+        edgeRewards[hasCorridor] = self.discount * corridorValues[first[hasCorridor]]
+        edgeDiscounts = self.discount ** (corridors["edgeLength"] + 1)
+
+        # coarse value iteration, where the policy is the best edges out of each node
+        values = nodeRewards
+        choice = None
+        self.sweeps = 0
+        stable = 0
+
+        while True:
+            utilities = edgeRewards + edgeDiscounts * values[edgeEnd]
+            best = numpy.zeros(len(values)) - numpy.inf
+            numpy.maximum.at(best, edgeStart, utilities)
+            tempValues = nodeRewards + numpy.where(best > -numpy.inf, best, 0)
+            tempChoice = utilities >= best[edgeStart]
+
+            self.sweeps += 1
+            self.residual = float(abs(tempValues - values).max())
+            if choice is not None and numpy.array_equal(choice, tempChoice):
+                stable += 1
+            else:
+                stable = 0
+
+            values = tempValues
+            choice = tempChoice
+
+            if self.isConverged(stable):
+                break
+
+        # expand to every coordinate, corridor coordinates taking the better of their two directions
+        endValues = values[edgeEnd]
+        cellValues = numpy.zeros(len(self.cells)) - numpy.inf
+        cellValues[corridors["nodes"]] = values
+        numpy.maximum.at(cellValues, corridors["entryCell"], self.getCorridorValues(rewards, endValues))
+
+        for i in range(self.fineSweeps):
+            cellValues = rewards + self.discount * self.getArrayUtilities(cellValues).max(axis=-1)
+        self.sweeps += self.fineSweeps
+
+        policy = self.getArrayUtilities(cellValues).argmax(axis=-1)
+
+        # translate back to the coordinate based maps used by getAction
+        valueMap = dict(zip(self.cells, cellValues.tolist()))
+        policy = dict((cell, self.allDirections[d]) for (cell, d) in zip(self.cells, policy.tolist()))
+
+        return (valueMap, policy)
+
+    # returns the utility of every corridor entry, when following its edge to the end node,
+    # given the utility of each edge's end node
+    def getCorridorValues(self, rewards, endValues):
+        corridors = self.corridors
+        entryNext = corridors["entryNext"]
+        entryValues = numpy.zeros(len(entryNext))
+        following = endValues[corridors["entryEdge"]]
+
+        # deepest entries first, so the next entry along the edge is always done
+        for group in corridors["positions"]:
+            nextValues = numpy.where(entryNext[group] >= 0, entryValues[entryNext[group]], following[group])
+            entryValues[group] = rewards[corridors["entryCell"][group]] + self.discount * nextValues
+
+        return entryValues
+
+    # splits the compiled coordinates into a band of whole rows per worker, and starts the
+    # worker processes of the parallel solver with the shared arrays
+    def startWorkers(self):
+        order = sorted(range(len(self.cells)), key=lambda index: self.cells[index][1])
+        self.bands = [[]]
+
+        for (position, index) in enumerate(order):
+            # start the next band on a new row, once this one has its share of coordinates
+            newRow = position > 0 and self.cells[index][1] != self.cells[order[position - 1]][1]
+            if newRow and position * self.workers >= len(self.bands) * len(order) and len(self.bands) < self.workers:
+                self.bands.append([])
+            self.bands[-1].append(index)
+
+        self.bands = [numpy.array(band, dtype=numpy.intp) for band in self.bands]
+        self.valueBuffers = [multiprocessing.RawArray('d', len(self.cells)) for i in range(2)]
+        self.policyBuffer = multiprocessing.RawArray('i', len(self.cells))
+        self.pool = multiprocessing.Pool(len(self.bands), startWorker, (self, self.valueBuffers, self.policyBuffer))
+
+    def stopWorkers(self):
+        if self.pool != None:
+            self.pool.terminate()
+            self.pool.join()
+
+        self.pool = None
+        self.bands = []
+        self.valueBuffers = []
+        self.policyBuffer = None
+
+    # numpy version of getPolicy for several agents' value maps at once, returning their policies
+    #
+    # the value maps are stacked into one array and swept together, each row stopping under the
+    # same rules (and after the same sweep) as it would on its own. the sweep statistics are
+    # recorded in each agent's telemetry, with the solving time shared out between them
+    def getBatchPolicies(self, agents, valueMaps):
+        start = time.time()
+        count = len(valueMaps)
+
+        values = numpy.array([[valueMap[cell] for cell in self.cells] for valueMap in valueMaps], dtype=float)
+        policies = self.getArrayUtilities(values).argmax(axis=-1)
+        sweeps = numpy.zeros(count, dtype=int)
+        stable = numpy.zeros(count, dtype=int)
+        residuals = numpy.zeros(count)
+        timedOut = numpy.zeros(count, dtype=bool)
+        active = numpy.arange(count)
+
+        while len(active) > 0:
+            change = self.discount * self.getArrayExpectedUtility(values[active])
+            values[active] = values[active] + change
+            tempPolicies = self.getArrayUtilities(values[active]).argmax(axis=-1)
+
+            sweeps[active] += 1
+            residuals[active] = abs(change).max(axis=-1)
+            same = (policies[active] == tempPolicies).all(axis=-1)
+            stable[active] = numpy.where(same, stable[active] + 1, 0)
+            policies[active] = tempPolicies
+
+            # stopping rules of isConverged, for each row
+            converged = stable[active] >= self.stableSweeps
+            if self.tolerance != None:
+                converged |= residuals[active] <= self.tolerance
+            if self.maxSweeps != None:
+                converged |= sweeps[active] >= self.maxSweeps
+            if self.deadlineTime != None and time.time() >= self.deadlineTime:
+                timedOut[active[~converged]] = True
+                converged[:] = True
+
+            active = active[~converged]
+
+        solveTime = (time.time() - start) / count
+        results = []
+
+        for (i, agent) in enumerate(agents):
+            agent.sweeps = int(sweeps[i])
+            agent.residual = float(residuals[i])
+            agent.timedOut = bool(timedOut[i])
+            agent.solveTime = solveTime
+            agent.recordTelemetry()
+
+            results.append(dict((cell, self.allDirections[d]) for (cell, d) in zip(self.cells, policies[i].tolist())))
+
+        return results
+
+    # modified policy iteration version of getPolicy
+    #
+    # the current policy is evaluated as the linear system V = R + discount * P V, where row c of
+    # the sparse matrix P holds the outcomes of moving in the policy direction from c, and then
+    # the policy is improved greedily. unlike the other solvers the utilities are the standard
+    # discounted sum of rewards, so the resulting policy can differ from theirs
+    def getSparsePolicy(self, valueMap):
+        size = len(self.cells)
+        rewards = numpy.array([valueMap[cell] for cell in self.cells], dtype=float)
+        values = rewards
+        if self.warmValues is not None:
+            values = self.warmValues
+        policy = self.getArrayUtilities(values).argmax(axis=1)
+
+        # every row has the same three probabilities, only the columns depend on the policy
+        rows = numpy.repeat(numpy.arange(size), 3)
+        probabilities = numpy.tile([0.8, 0.1, 0.1], size)
+        identity = scipy.sparse.identity(size, format="csr")
+
+        self.sweeps = 0
+        stable = 0
+
+        while True:
+            # policy evaluation, duplicate (row, column) outcomes are summed
+            columns = self.successors[numpy.arange(size), policy].ravel()
+            transition = scipy.sparse.csr_matrix((probabilities, (rows, columns)), shape=(size, size))
+
+            if self.evaluationSteps == 0:
+                tempValues = scipy.sparse.linalg.spsolve(identity - self.discount * transition, rewards)
+            else:
+                tempValues = values
+                for i in range(self.evaluationSteps):
+                    tempValues = rewards + self.discount * transition.dot(tempValues)
+
+            # policy improvement, keeping the current direction unless another is clearly
+            # better, otherwise rounding errors between equally good directions never settle
+            utilities = self.getArrayUtilities(tempValues)
+            tempPolicy = utilities.argmax(axis=1)
+            current = utilities[numpy.arange(size), policy]
+            tempPolicy = numpy.where(current >= utilities.max(axis=1) - 1e-9, policy, tempPolicy)
+
+            self.sweeps += 1
+            self.residual = float(abs(tempValues - values).max())
+            if numpy.array_equal(policy, tempPolicy):
+                stable += 1
+            else:
+                stable = 0
+
+            values = tempValues
+            policy = tempPolicy
+
+            # an exactly evaluated policy that improvement keeps is optimal already
+            if self.isConverged(stable) or (self.evaluationSteps == 0 and stable > 0):
+                break
+
+        if self.warmStart:
+            self.warmValues = values
+
+        # translate back to the coordinate based maps used by getAction
+        valueMap = dict(zip(self.cells, values.tolist()))
+        policy = dict((cell, self.allDirections[d]) for (cell, d) in zip(self.cells, policy.tolist()))
+
+        return (valueMap, policy)
+
+    # numpy version of getMaxExpectedUtility, returns the utility of every (coordinate, direction)
+    #
+    # values can also be a stack of value arrays, one per row, as used by getBatchPolicies, and
+    # successors some rows of the compiled successors, for just those coordinates
+    def getArrayUtilities(self, values, successors=None):
+        if successors is None:
+            successors = self.successors
+
+        outcomes = values[..., successors]
+        return 0.8 * outcomes[..., 0] + 0.1 * outcomes[..., 1] + 0.1 * outcomes[..., 2]
+
+    # numpy version of getExpectedUtility, summed in the same order to give identical values
+    def getArrayExpectedUtility(self, values, successors=None):
+        if successors is None:
+            successors = self.successors
+
+        outcomes = values[..., successors]
+        accumulator = numpy.zeros(outcomes.shape[:-2])
+
+        for d in range(len(self.allDirections)):
+            accumulator += 0.8 * outcomes[..., d, 0]
+            accumulator += 0.1 * outcomes[..., d, 1]
+            accumulator += 0.1 * outcomes[..., d, 2]
+
+        return accumulator / 4
 
     # get the next expected utility of a certain coordinate
     def getExpectedUtility(self, valueMap, coordinate):
         accumulator = 0
 
-        for direct in self.allDirections:
+        for (direct, outcomes) in self.transitions[coordinate]:
             # calculate utility value of a given direction
-            accumulator += 0.8 * valueMap[self.getTransitionVector(coordinate, direct)]
-            accumulator += 0.1 * valueMap[self.getTransitionVector(coordinate, self.translateDirection(direct, Directions.WEST))]
-            accumulator += 0.1 * valueMap[self.getTransitionVector(coordinate, self.translateDirection(direct, Directions.EAST))]
+            for (successor, probability) in outcomes:
+                accumulator += probability * valueMap[successor]
 
         return accumulator / 4
 
@@ -197,12 +1118,11 @@ class MDPAgent(Agent):
         bestDirection = None
         bestValue = None
 
-        for direct in self.allDirections:
+        for (direct, outcomes) in self.transitions[coordinate]:
             # calculate utility value of a given direction
             accumulator = 0
-            accumulator += 0.8 * valueMap[self.getTransitionVector(coordinate, direct)]
-            accumulator += 0.1 * valueMap[self.getTransitionVector(coordinate, self.translateDirection(direct, Directions.WEST))]
-            accumulator += 0.1 * valueMap[self.getTransitionVector(coordinate, self.translateDirection(direct, Directions.EAST))]
+            for (successor, probability) in outcomes:
+                accumulator += probability * valueMap[successor]
 
             # update the "max" utility
             if bestValue == None:
@@ -239,62 +1159,69 @@ class MDPAgent(Agent):
 
     # returns the final direction of 2 directions
     def translateDirection(self, directionx, directiony):
-        dirValue = {
-            Directions.NORTH : 0,
-            Directions.EAST : 1,
-            Directions.SOUTH : 2,
-            Directions.WEST : 3,
-            Directions.STOP : 0
-        }
+        value = (self.dirValue[directionx] + self.dirValue[directiony]) % 4
 
-        value = (dirValue[directionx] + dirValue[directiony]) % 4
-
-        if value == 0:
-            return Directions.NORTH
-        elif value == 1:
-            return Directions.EAST
-        elif value == 2:
-            return Directions.SOUTH
-        elif value == 3:
-            return Directions.WEST
+        return self.allDirections[value]
 
 
     # get the reward of a coordinate depending on the type of path it is
     def getPathReward(self, coordinate):
-        if coordinate in self.deadends:
+        if self.deadendMask & self.cellBits[coordinate]:
             return self.deadEndRewardReduction
         else:
             return self.pathReward
 
-    # returns targets found and its distance within a certain number of moves
-    def getTargetsInRadius(self, source, targets, moves):
-        affectedVectors = list()
+    # returns a hashable summary of everything the rewards of a move depend on
+    #
+    # scared timers are capped, as any timer above twice the ghost radius gives the same rewards
+    def getSituation(self, pacman, ghosts):
+        ghostSituation = tuple((tuple(map(int, coordinate)), min(timer, 2 * self.ghostRadius + 1)) for (coordinate, timer) in ghosts)
+
+        return (pacman, ghostSituation, self.foodMask, self.capsuleMask)
+
+    # returns the cached policy of a situation (marking it as recently used), or None
+    def getCachedPolicy(self, situation):
+        policy = self.policyCache.pop(situation, None)
 
-        newVectors = list()
-        newVectors.append(source)
+        if policy == None:
+            self.cacheMisses += 1
+        else:
+            self.cacheHits += 1
+            self.policyCache[situation] = policy
+
+        return policy
+
+    # caches the policy of a situation, evicting the least recently used one when full
+    def cachePolicy(self, situation, policy):
+        self.policyCache[situation] = policy
 
-        found = {}  #coordinate: distance
+        if len(self.policyCache) > self.cacheSize:
+            self.policyCache.popitem(last=False)
+
+    # returns the number of moves to every coordinate within a certain number of moves of source
+    def getDistancesInRadius(self, source, moves):
+        distances = {source: 0}
+        newVectors = [source]
 
-        # search within a limited number of moves
         for i in range(moves):
             tempVectors = list()
 
-            # search adjacent to the last batch of explored coordinates
             for vect in newVectors:
-                for direct in self.allDirections:
-                    newVector = self.getTransitionVector(vect, direct)
-                    
-                    if newVector not in affectedVectors:
-                        # record number of moves to reach target
-                        if newVector in targets:
-                            found[newVector] = i + 1
-
-                        affectedVectors.append(newVector)
+                for (direct, outcomes) in self.transitions[vect]:
+                    newVector = outcomes[0][0]
+
+                    if newVector not in distances:
+                        distances[newVector] = i + 1
                         tempVectors.append(newVector)
 
             newVectors = tempVectors
-        
-        return found
+
+        return distances
+
+    # returns targets found and its distance within a certain number of moves
+    def getTargetsInRadius(self, source, targets, moves):
+        distances = self.getDistancesInRadius(source, moves)
+        return dict((target, distances[target]) for target in targets if target in distances)
 
 
     # debugging: displays the map and policy of coordinates
@@ -359,7 +1286,7 @@ class MDPAgent(Agent):
                         text += "P"
                     elif (i, self.height - 1 - j) in ghosts:
                         text += "G"
-                    elif (i, self.height - 1 - j) in self.foundFoods:
+                    elif self.foodMask & self.cellBits[(i, self.height - 1 - j)]:
                         text += "."
                     else:
                         text += " "
@@ -369,6 +1296,53 @@ class MDPAgent(Agent):
 
 
     def getAction(self, state):
+        # the deadline covers the whole move, not just value iteration
+        if self.deadline != None:
+            self.deadlineTime = time.time() + self.deadline
+
+        currentValueMap = self.getRewards(state)
+
+        # policy iteration process, unless this situation's policy is cached
+        if currentValueMap == None:
+            policy = self.cachedPolicy
+        else:
+            (currentValueMap, policy) = self.getPolicy(currentValueMap, self.pacman)
+
+        # debugging purposes
+        #print self.displayPolicy(self.pacman, api.ghosts(state), policy)
+        #print policy[self.pacman]
+        #self.viewUtility(currentValueMap, self.pacman, api.ghosts(state), policy)
+
+        return self.chooseAction(policy)
+
+    # batched version of getAction, for agents playing separate games on the same layout
+    #
+    # with the numpy solver the value iterations of all the agents are run together as one
+    # stacked array computation, otherwise each agent just runs getAction on its own state
+    @staticmethod
+    def getBatchActions(agents, states):
+        if agents[0].solver != "numpy":
+            return [agent.getAction(state) for (agent, state) in zip(agents, states)]
+
+        for agent in agents:
+            if agent.deadline != None:
+                agent.deadlineTime = time.time() + agent.deadline
+
+        valueMaps = [agent.getRewards(state) for (agent, state) in zip(agents, states)]
+        policies = [agent.cachedPolicy for agent in agents]
+
+        # agents whose situation is cached don't need solving
+        solving = [i for i in range(len(agents)) if valueMaps[i] != None]
+        if solving:
+            results = agents[solving[0]].getBatchPolicies([agents[i] for i in solving], [valueMaps[i] for i in solving])
+            for (i, policy) in zip(solving, results):
+                policies[i] = policy
+
+        return [agent.chooseAction(policy) for (agent, policy) in zip(agents, policies)]
+
+    # updates the state trackers and returns the rewards of the current state, or None when
+    # the policy of the current situation is cached (it is then left in cachedPolicy)
+    def getRewards(self, state):
         # Get the actions we can try, and remove "STOP" if that is one of them.
         legal = api.legalActions(state)
 
@@ -377,24 +1351,38 @@ class MDPAgent(Agent):
 
         pacman = api.whereAmI(state)
 
+        # kept for chooseAction
+        self.legal = legal
+        self.pacman = pacman
+        self.cachedPolicy = None
+
         # update state trackers (same result can be obtained from api calls, but is less computationally taxing)
-        if pacman in self.foundFoods:
-            self.foundFoods.remove(pacman)
+        bit = self.cellBits[pacman]
+        if self.foodMask & bit:
+            self.foodMask &= ~bit
+            self.foodCount -= 1
             self.baseValueMap[pacman] = self.getPathReward(pacman)
-        elif pacman in self.capsules:
-            self.capsules.remove(pacman)
+        elif self.capsuleMask & bit:
+            self.capsuleMask &= ~bit
             self.baseValueMap[pacman] = self.getPathReward(pacman)
 
         # set state dependent rewards
-        closeGhostReward = -self.foodReward * 2 * len(self.foundFoods)   # large amounts of food can skew the rewards
-        farGhostReward = -self.foodReward * 0.5 * len(self.foundFoods)
+        closeGhostReward = -self.foodReward * 2 * self.foodCount   # large amounts of food can skew the rewards
+        farGhostReward = -self.foodReward * 0.5 * self.foodCount
         lastFoodReward = -closeGhostReward * self.discount # more risk can be taken if it is a terminating state
         urgentCapsuleReward = -closeGhostReward * self.discount  # capsules can save pacman from dire situations
         scaredGhostReward = min(self.foodReward * 5, -farGhostReward)
 
         # last food reward (terminating state)
-        if len(self.foundFoods) == 1:
-            self.baseValueMap[self.foundFoods[0]] = lastFoodReward
+        if self.foodCount == 1:
+            self.baseValueMap[self.getCells(self.foodMask)[0]] = lastFoodReward
+
+        # reuse the policy of an earlier identical situation
+        if self.cacheSize > 0:
+            self.situation = self.getSituation(pacman, api.ghostStatesWithTimes(state))
+            self.cachedPolicy = self.getCachedPolicy(self.situation)
+            if self.cachedPolicy != None:
+                return None
 
         # set rewards of current state
         currentValueMap = dict(self.baseValueMap)
@@ -407,7 +1395,7 @@ class MDPAgent(Agent):
             ghostLocations[i] = tuple(map(int, ghostLocations[i]))
 
         ghosts = api.ghostStatesWithTimes(state)
-        ghostDistances = self.getTargetsInRadius(pacman, ghostLocations, 10)
+        ghostDistances = self.getTargetsInRadius(pacman, ghostLocations, self.ghostRadius)
         
         safeRespawn = True  # respawn area is dangerous if ghosts can be eaten
         danger = False  # determines importance of capsules
@@ -439,7 +1427,7 @@ class MDPAgent(Agent):
 
         # hostile ghosts nearby -> increased capsule reward
         if danger:
-            for cap in self.capsules:
+            for cap in self.getCells(self.capsuleMask):
                 currentValueMap[cap] = urgentCapsuleReward
 
         # respawn area is dangerous if ghosts can be eaten
@@ -447,15 +1435,14 @@ class MDPAgent(Agent):
             for ghostRespawn in self.ghostSpawn:
                 currentValueMap[ghostRespawn] = self.ghostRespawnReward
 
-        # policy iteration process
-        (currentValueMap, policy) = self.getPolicy(currentValueMap)
+        return currentValueMap
+
+    # caches the converged policy of the current situation, and selects the optimal action
+    def chooseAction(self, policy):
+        if self.cacheSize > 0:
+            self.cachePolicy(self.situation, policy)
 
         # select optimal action
-        newDirect = policy[pacman]
-        
-        # debugging purposes
-        #print self.displayPolicy(pacman, ghostLocations, policy)
-        #print policy[pacman]
-        #self.viewUtility(currentValueMap, pacman, ghostLocations, policy)
+        newDirect = policy[self.pacman]
 
-        return api.makeMove(newDirect, legal)
+        return api.makeMove(newDirect, self.legal)
@@ -0,0 +1,82 @@
+# mdpBenchmark.py
+#
+# Plays MDPAgent games with each of the given value iteration solvers on
+# each of the given layouts, and reports the average number of sweeps
+# and the solver time per move, e.g.
+#
+#   python mdpBenchmark.py -s value,gaussSeidel,prioritized -l mediumClassic,trickyClassic
+#
+# The in place solvers (gaussSeidel and prioritized) solve the same
+# discounted utilities as the policy solver, so that is the one to
+# compare their sweeps and policies with.
+#
+# With no layouts given, every layout in layouts/ is used. Games are
+# played with the same random seed for every solver.
+
+from optparse import OptionParser
+import os
+import random
+import sys
+
+import ghostAgents
+import layout
+import pacman
+import textDisplay
+from mdpAgents import MDPAgent
+
+def readCommand(argv):
+    parser = OptionParser("python mdpBenchmark.py <options>")
+    parser.add_option('-s', '--solvers', dest='solvers', default='value,policy,gaussSeidel,prioritized',
+                      help='comma separated MDPAgent solvers to compare')
+    parser.add_option('-l', '--layouts', dest='layouts', default=None,
+                      help='comma separated layouts to play, all of layouts/ when not given')
+    parser.add_option('-n', '--numGames', dest='numGames', type='int', default=1,
+                      help='the number of games to play per solver and layout')
+    parser.add_option('-a', '--agentArgs', dest='agentArgs', default=None,
+                      help='extra agent args shared by every solver, e.g. "stableSweeps=2"')
+    parser.add_option('--seed', dest='seed', type='int', default=43,
+                      help='random seed used at the start of each layout and solver')
+
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+
+    if options.layouts == None:
+        options.layouts = ','.join(sorted(name[:-4] for name in os.listdir('layouts') if name.endswith('.lay')))
+
+    return options
+
+# plays the games of one solver on one layout, returning the telemetry of every move
+def benchmark(layoutName, solver, numGames, agentOpts, seed):
+    random.seed(seed)
+    gameLayout = layout.getLayout(layoutName)
+    agent = MDPAgent(solver=solver, **agentOpts)
+    ghosts = [ghostAgents.RandomGhost(i + 1) for i in range(gameLayout.getNumGhosts())]
+    rules = pacman.ClassicGameRules()
+    moves = []
+
+    for i in range(numGames):
+        game = rules.newGame(gameLayout, agent, ghosts, textDisplay.NullGraphics(), True)
+        game.run()
+        moves += agent.telemetry
+
+    return moves
+
+def runBenchmark(options):
+    solvers = options.solvers.split(',')
+    agentOpts = pacman.parseAgentArgs(options.agentArgs)
+
+    print '%-22s %-12s %7s %10s %12s %12s' % ('layout', 'solver', 'moves', 'sweeps', 'ms/move', 'ms/sweep')
+    for layoutName in options.layouts.split(','):
+        for solver in solvers:
+            moves = benchmark(layoutName, solver, options.numGames, agentOpts, options.seed)
+            if not moves:
+                continue
+
+            sweeps = sum(move[0] for move in moves)
+            seconds = sum(move[1] for move in moves)
+            print '%-22s %-12s %7d %10.1f %12.3f %12.4f' % (layoutName, solver, len(moves),
+                sweeps / float(len(moves)), 1000 * seconds / len(moves), 1000 * seconds / max(sweeps, 1))
+
+if __name__ == '__main__':
+    runBenchmark(readCommand(sys.argv[1:]))
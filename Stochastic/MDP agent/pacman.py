@@ -44,6 +44,7 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
+from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
 import util, layout
@@ -72,13 +73,36 @@ class GameState:
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
+    # static variables keep track of the states generateSuccessor is called on and creates,
+    # once turned on with trackExplored (off by default, as recording a state costs a hash)
     explored = set()
+    exploredMode = None     # None: off, 'count': only count the states, 'states': keep them too
+    exploredLimit = None    # most states kept in explored, None for no limit
+    exploredCount = 0       # states recorded (repeats included) since the last reset
+    def trackExplored(mode='states', limit=None):
+        if mode not in [None, 'count', 'states']:
+            raise Exception('Unknown explored state tracking mode: ' + str(mode))
+        GameState.exploredMode = mode
+        GameState.exploredLimit = limit
+        GameState.getAndResetExplored()
+    trackExplored = staticmethod(trackExplored)
     def getAndResetExplored():
         tmp = GameState.explored.copy()
         GameState.explored = set()
+        GameState.exploredCount = 0
         return tmp
     getAndResetExplored = staticmethod(getAndResetExplored)
+    def getExploredCount():
+        return GameState.exploredCount
+    getExploredCount = staticmethod(getExploredCount)
+    def recordExplored(states):
+        GameState.exploredCount += len(states)
+        if GameState.exploredMode == 'states':
+            for state in states:
+                if GameState.exploredLimit != None and len(GameState.explored) >= GameState.exploredLimit:
+                    break
+                GameState.explored.add(state)
+    recordExplored = staticmethod(recordExplored)
 
     def getLegalActions( self, agentIndex=0 ):
         """
@@ -113,7 +137,7 @@ class GameState:
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
-            GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            GhostRules.decrementTimer( state.data.getAgentStateForWrite( agentIndex ) )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -121,8 +145,8 @@ class GameState:
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
+        if GameState.exploredMode != None:
+            GameState.recordExplored([self, state])
         return state
 
     def getLegalPacmanActions( self ):
@@ -274,11 +298,11 @@ class ClassicGameRules:
         self.excellenceScore = 0
         self.games = 0
 
-    def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False):
+    def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False, fast=False):
         agents = [pacmanAgent] + ghostAgents[:layout.getNumGhosts()]
         initState = GameState()
         initState.initialize( layout, len(ghostAgents) )
-        game = Game(agents, display, self, catchExceptions=catchExceptions)
+        game = Game(agents, display, self, catchExceptions=catchExceptions, fast=fast)
         game.state = initState
         self.initialState = initState.deepCopy()
         self.quiet = quiet
@@ -346,7 +370,8 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        layout = state.data.layout
+        return Actions.getPossibleActions( state.getPacmanState().configuration, layout.walls, layout.actionTable )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action ):
@@ -357,7 +382,7 @@ class PacmanRules:
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.getAgentStateForWrite( 0 )
 
         # Update Configuration
         vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
@@ -376,7 +401,7 @@ class PacmanRules:
         # Eat food
         if state.data.food[x][y]:
             state.data.scoreChange += 10
-            state.data.food = state.data.food.copy()
+            state.data.food = state.data.food.columnCopy( x )
             state.data.food[x][y] = False
             state.data._foodEaten = position
             # TODO: cache numFood?
@@ -386,11 +411,12 @@ class PacmanRules:
                 state.data._win = True
         # Eat capsule
         if( position in state.getCapsules() ):
+            state.data.capsules = state.data.capsules[:]
             state.data.capsules.remove( position )
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range( 1, len( state.data.agentStates ) ):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.getAgentStateForWrite( index ).scaredTimer = SCARED_TIME
     consume = staticmethod( consume )
 
 class GhostRules:
@@ -404,7 +430,8 @@ class GhostRules:
         reach a dead end, but can turn 90 degrees at intersections.
         """
         conf = state.getGhostState( ghostIndex ).configuration
-        possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
+        layout = state.data.layout
+        possibleActions = Actions.getPossibleActions( conf, layout.walls, layout.actionTable )
         reverse = Actions.reverseDirection( conf.direction )
         if Directions.STOP in possibleActions:
             possibleActions.remove( Directions.STOP )
@@ -419,7 +446,7 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.getAgentStateForWrite( ghostIndex )
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
         vector = Actions.directionToVector( action, speed )
@@ -429,7 +456,9 @@ class GhostRules:
     def decrementTimer( ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+            # a new configuration, as the current one may be shared with other states
+            ghostState.configuration = Configuration( nearestPoint( ghostState.configuration.pos ),
+                                                      ghostState.configuration.direction )
         ghostState.scaredTimer = max( 0, timer - 1 )
     decrementTimer = staticmethod( decrementTimer )
 
@@ -451,9 +480,11 @@ class GhostRules:
     def collide( state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            ghostState = state.data.getAgentStateForWrite( agentIndex )
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
             # Added for first-person
+            state.data._eaten = state.data._eaten[:]
             state.data._eaten[agentIndex] = True
         else:
             if not state.data._win:
@@ -538,16 +569,33 @@ def readCommand( argv ):
                       help='Turns on exception handling and timeouts during games', default=False)
     parser.add_option('--timeout', dest='timeout', type='int',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--trackExplored', dest='trackExplored', type='choice', choices=['count', 'states'],
+                      help='Records the states successors are generated from and to: count them, or keep them', default=None)
+    parser.add_option('--exploredLimit', dest='exploredLimit', type='int',
+                      help='Most explored states to keep with --trackExplored states (default no limit)', default=None)
+    parser.add_option('--batch', dest='batch', type='int',
+                      help=default('How many games to play at a time in lockstep, without graphics or timeouts'), default=1)
+    parser.add_option('--workers', dest='workers', type='int',
+                      help=default('How many processes to play games in at once, without graphics, for agents that don\'t learn between games'), default=1)
+    parser.add_option('--fast', action='store_true', dest='fast',
+                      help='Plays quiet (-q) games in a faster loop that gives agents the game\'s own states, which they must not change, instead of copies', default=False)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
         raise Exception('Command line input not understood: ' + str(otherjunk))
+    if options.fast and (not options.quietGraphics or options.catchExceptions):
+        raise Exception('Only quiet games without exception handling (-q without -c) can be played fast')
+    if options.batch > 1 and options.workers > 1:
+        raise Exception('Games can be played in batches or in worker processes, but not both')
     args = dict()
 
     # Fix the random seed
     # if options.fixRandomSeed: random.seed('cs188')
     if options.fixRandomSeed: random.seed(43)
 
+    # Explored state instrumentation
+    if options.trackExplored: GameState.trackExplored(options.trackExplored, options.exploredLimit)
+
     # Choose a layout
     args['layout'] = layout.getLayout( options.layout )
     if args['layout'] == None: raise Exception("The layout " + options.layout + " cannot be found")
@@ -556,6 +604,9 @@ def readCommand( argv ):
     noKeyboard = options.gameToReplay == None and (options.textGraphics or options.quietGraphics)
     pacmanType = loadAgent(options.pacman, noKeyboard)
     agentOpts = parseAgentArgs(options.agentArgs)
+    if options.workers > 1 and agentOpts.get('solver') == 'parallel':
+        # worker processes are daemons, which can't start processes of their own
+        raise Exception('The parallel solver starts its own processes, so it can\'t be used in games played in worker processes')
     if options.numTraining > 0:
         args['numTraining'] = options.numTraining
         if 'numTraining' not in agentOpts: agentOpts['numTraining'] = options.numTraining
@@ -586,6 +637,9 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['batch'] = options.batch
+    args['workers'] = options.workers
+    args['fast'] = options.fast
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
@@ -641,34 +695,181 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
+def recordGame( layout, game, i ):
+    import time, cPickle
+    fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+    f = file(fname, 'w')
+    components = {'layout': layout, 'actions': game.moveHistory}
+    cPickle.dump(components, f)
+    f.close()
+
+def runBatchedGames( layout, pacman, ghosts, numGames, record, numTraining, batch, fast, rules ):
+    """
+    Plays the games batch at a time in lockstep, each game of a batch with its
+    own copy of the pacman agent. On Pacman's turn, agents with a
+    getBatchActions method decide the moves of every game in a single call.
+
+    Games are played without graphics, timeouts or exception handling.
+    When fast is set, agents are given the games' own states rather than
+    copies, as in Game.runFast.
+    """
+    import copy, textDisplay
+    pacmen = [pacman] + [copy.deepcopy(pacman) for i in range(batch - 1)]
+    games = []
+
+    for first in range(0, numGames, batch):
+        played = []
+        for i in range(min(batch, numGames - first)):
+            beQuiet = first + i < numTraining
+            game = rules.newGame( layout, pacmen[i], ghosts, textDisplay.NullGraphics(), beQuiet )
+            game.quiet = beQuiet
+            played.append(game)
+
+            for agent in game.agents:
+                if 'registerInitialState' in dir(agent):
+                    agent.registerInitialState(game.state.deepCopy())
+
+        current = list(played)
+        agentIndex = 0
+        numAgents = len(current[0].agents)
+        while current:
+            observations = []
+            for game in current:
+                agent = game.agents[agentIndex]
+                state = game.state if fast else game.state.deepCopy()
+                if 'observationFunction' in dir(agent):
+                    observations.append(agent.observationFunction(state))
+                else:
+                    observations.append(state)
+
+            if agentIndex == 0 and 'getBatchActions' in dir(pacman):
+                actions = pacman.getBatchActions([game.agents[0] for game in current], observations)
+            else:
+                actions = [game.agents[agentIndex].getAction(observation) for (game, observation) in zip(current, observations)]
+
+            for (game, action) in zip(current, actions):
+                game.moveHistory.append( (agentIndex, action) )
+                game.state = game.state.generateSuccessor( agentIndex, action )
+                rules.quiet = game.quiet
+                rules.process(game.state, game)
+
+                if game.gameOver:
+                    for agent in game.agents:
+                        if 'final' in dir(agent):
+                            agent.final(game.state)
+
+            current = [game for game in current if not game.gameOver]
+            agentIndex = (agentIndex + 1) % numAgents
+
+        for (i, game) in enumerate(played):
+            if not game.quiet: games.append(game)
+            if record: recordGame( layout, game, first + i )
+
+    return games
+
+class PlayedGame:
+    """
+    What runParallelGames gets back of a game played in a worker process:
+    enough for the rules to end it, for recordGame and for the summary.
+    """
+    def __init__( self, game, seconds, explored ):
+        self.state = game.state
+        self.moveHistory = game.moveHistory
+        self.agentCrashed = game.agentCrashed
+        self.agentTimeout = game.agentTimeout
+        self.totalAgentTimes = game.totalAgentTimes
+        self.gameOver = game.gameOver
+        self.seconds = seconds
+        self.explored = explored  # states the game's successors were generated from and to
+
+# the layout, agents and rules of the games a worker process plays, set by startGameWorker
+GAME_WORKER = {}
+
+def startGameWorker( layout, pacman, ghosts, timeout, catchExceptions, fast ):
+    GAME_WORKER['layout'] = layout
+    GAME_WORKER['pacman'] = pacman
+    GAME_WORKER['ghosts'] = ghosts
+    GAME_WORKER['catchExceptions'] = catchExceptions
+    GAME_WORKER['fast'] = fast
+    GAME_WORKER['rules'] = ClassicGameRules(timeout)
+
+def playGame( seed ):
+    """
+    Plays one game in a worker process, with the random number generator
+    seeded with seed, and returns it as a PlayedGame.
+    """
+    import textDisplay
+    random.seed(seed)
+    start = time.time()
+    explored = GameState.getExploredCount()
+    game = GAME_WORKER['rules'].newGame( GAME_WORKER['layout'], GAME_WORKER['pacman'], GAME_WORKER['ghosts'],
+                                         textDisplay.NullGraphics(), True, GAME_WORKER['catchExceptions'], GAME_WORKER['fast'] )
+    game.run()
+    return PlayedGame( game, time.time() - start, GameState.getExploredCount() - explored )
+
+def runParallelGames( layout, pacman, ghosts, numGames, record, numTraining, catchExceptions, timeout, workers, fast, rules ):
+    """
+    Plays the games in a pool of worker processes, each game with its own
+    copy of the agents and its own random seed. The seeds are drawn from
+    the random number generator first, so a fixed seed (-f) plays the same
+    games whatever the number of workers.
+
+    Games are played without graphics, and as the agents are copies,
+    nothing they learn carries over from one game to the next. The games
+    are ended by rules in this process, in order, so their messages are
+    the same as when they're played one at a time. Explored states are
+    counted across workers, but only kept in the worker that explored them.
+    """
+    import multiprocessing
+    seeds = [random.randint(0, 2 ** 31 - 1) for i in range( numGames )]
+    pool = multiprocessing.Pool( workers, startGameWorker, (layout, pacman, ghosts, timeout, catchExceptions, fast) )
+    games = []
+
+    try:
+        for (i, game) in enumerate( pool.imap( playGame, seeds ) ):
+            beQuiet = i < numTraining
+            rules.quiet = beQuiet
+            rules.process( game.state, game )
+            GameState.exploredCount += game.explored
+            if not beQuiet: games.append(game)
+
+            if record:
+                recordGame( layout, game, i )
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return games
+
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, batch=1, workers=1, fast=False ):
     import __main__
     __main__.__dict__['_display'] = display
 
     rules = ClassicGameRules(timeout)
     games = []
+    start = time.time()
 
-    for i in range( numGames ):
-        beQuiet = i < numTraining
-        if beQuiet:
-                # Suppress output and graphics
-            import textDisplay
-            gameDisplay = textDisplay.NullGraphics()
-            rules.quiet = True
-        else:
-            gameDisplay = display
-            rules.quiet = False
-        game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
-        game.run()
-        if not beQuiet: games.append(game)
-
-        if record:
-            import time, cPickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            cPickle.dump(components, f)
-            f.close()
+    if workers > 1:
+        games = runParallelGames( layout, pacman, ghosts, numGames, record, numTraining, catchExceptions, timeout, workers, fast, rules )
+    elif batch > 1:
+        games = runBatchedGames( layout, pacman, ghosts, numGames, record, numTraining, batch, fast, rules )
+    else:
+        for i in range( numGames ):
+            beQuiet = i < numTraining
+            if beQuiet:
+                    # Suppress output and graphics
+                import textDisplay
+                gameDisplay = textDisplay.NullGraphics()
+                rules.quiet = True
+            else:
+                gameDisplay = display
+                rules.quiet = False
+            game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions, fast)
+            game.run()
+            if not beQuiet: games.append(game)
+
+            if record:
+                recordGame( layout, game, i )
 
     if (numGames-numTraining) > 0:
         scores = [game.state.getScore() for game in games]
@@ -678,6 +879,11 @@ def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0
         print 'Scores:       ', ', '.join([str(score) for score in scores])
         print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
         print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+        if workers > 1:
+            seconds = sum([game.seconds for game in games])
+            print 'Game Time:     %.2fs per game, %.2fs in all on %d workers' % (seconds / len(games), time.time() - start, workers)
+    if GameState.exploredMode != None:
+        print 'Explored states:', GameState.getExploredCount()
 
     return games
 